@@ -0,0 +1,221 @@
+import numpy as np
+
+from numba import njit, prange
+
+"""
+Compiled (numba) versions of the trade simulation used for backtesting signal models.
+They work with numpy arrays and produce the same results as the reference implementation
+simulated_trade_performance in gen_signals but are fast enough to be executed for each point of a large grid.
+"""
+
+
+def simulated_trade_performance_arrays(buy_signal, sell_signal, price, index=None, with_transactions=False):
+    """
+    Simulate trades using the buy/sell signal and price arrays and return the same (performance, long performance, short performance)
+    as simulated_trade_performance. Lists of transactions are returned only if requested (then index is used to identify the rows).
+    """
+    buy_signal = to_signal_array(buy_signal)
+    sell_signal = to_signal_array(sell_signal)
+    price = np.asarray(price, dtype=np.float64)
+
+    long_stats, short_stats, longs, shorts = _simulate_trades(sell_signal, buy_signal, price, with_transactions)
+
+    performance, long_performance, short_performance = _performance_dicts(long_stats, short_stats)
+    if with_transactions:
+        if index is None:
+            index = np.arange(len(price))
+        long_performance["transactions"] = _transaction_list(index, longs)  # Sell transactions
+        short_performance["transactions"] = _transaction_list(index, shorts)  # Buy transactions
+
+    return performance, long_performance, short_performance
+
+
+def threshold_rule_grid_performance(score, price, parameter_list: list, score_2=None):
+    """
+    Simulate trades for many parameter sets of the threshold_rule (one score) or threshold_rule2 (two scores) generators.
+    The signals are computed from the score arrays directly in one compiled pass which is parallelized over the parameter sets.
+    Return a list of (performance, long performance, short performance) for each parameter dict (without transactions).
+
+    Each parameter dict has buy_signal_threshold and sell_signal_threshold keys (and additionally
+    buy_signal_threshold_2 and sell_signal_threshold_2 keys for two scores).
+    """
+    score = np.asarray(score, dtype=np.float64)
+    price = np.asarray(price, dtype=np.float64)
+    has_score_2 = score_2 is not None
+    score_2 = np.asarray(score_2, dtype=np.float64) if has_score_2 else np.empty(0, dtype=np.float64)
+
+    thresholds = np.array([
+        [
+            p["buy_signal_threshold"], p["sell_signal_threshold"],
+            p["buy_signal_threshold_2"] if has_score_2 else 0.0, p["sell_signal_threshold_2"] if has_score_2 else 0.0,
+        ]
+        for p in parameter_list
+    ], dtype=np.float64).reshape(len(parameter_list), 4)
+
+    float_stats, int_stats = _simulate_threshold_grid(score, score_2, price, thresholds, has_score_2)
+
+    results = []
+    for i in range(len(parameter_list)):
+        long_stats = (float(float_stats[i, 0]), float(float_stats[i, 1]), int(int_stats[i, 0]), int(int_stats[i, 1]))
+        short_stats = (float(float_stats[i, 2]), float(float_stats[i, 3]), int(int_stats[i, 2]), int(int_stats[i, 3]))
+        results.append(_performance_dicts(long_stats, short_stats))
+
+    return results
+
+
+def _performance_dicts(long_stats: tuple, short_stats: tuple):
+    long_performance = _side_performance(*long_stats)  # Performance of buy at low price and sell at high price
+    short_performance = _side_performance(*short_stats)  # Performance of sell at high price and buy at low price
+
+    profit = long_stats[0] + short_stats[0]
+    profit_percent = long_stats[1] + short_stats[1]
+    transaction_no = long_stats[2] + short_stats[2]
+    profitable = (long_stats[3] + short_stats[3]) / transaction_no if transaction_no else 0.0
+    performance = dict(
+        profit=profit,
+        profit_percent=profit_percent,
+        transaction_no=transaction_no,
+        profitable=profitable,
+
+        profit_per_transaction=profit / transaction_no if transaction_no else 0.0,
+        profitable_percent=100.0 * profitable / transaction_no if transaction_no else 0.0,
+    )
+
+    return performance, long_performance, short_performance
+
+
+def to_signal_array(values) -> np.ndarray:
+    """Convert signal values to a boolean array using the Python truth semantics (e.g., NaN is true) as the reference implementation does."""
+    values = np.asarray(values)
+    if values.dtype == np.bool_:
+        return values
+    if values.dtype.kind in "iuf":
+        return values != 0  # NaN != 0 is true as bool(nan)
+    return np.array([bool(x) for x in values], dtype=np.bool_)
+
+
+def _side_performance(profit, profit_percent, transaction_no, profitable_no):
+    return dict(
+        profit=profit,
+        profit_percent=profit_percent,
+        transaction_no=transaction_no,
+        profitable=profitable_no / transaction_no if transaction_no else 0.0,
+    )
+
+
+def _transaction_list(index, transactions):
+    positions, previous_prices, prices, profits, profit_percents = transactions
+    return [
+        (index[positions[i]], float(previous_prices[i]), float(prices[i]), float(profits[i]), float(profit_percents[i]))
+        for i in range(len(positions))
+    ]
+
+
+@njit(cache=True)
+def _simulate_trades(sell_signal, buy_signal, price, with_transactions):
+    """
+    The same state machine as in simulated_trade_performance. Statistics are returned as tuples
+    (profit, profit percent, number of transactions, number of profitable transactions).
+    Transactions are returned as arrays (positions, previous prices, prices, profits, profit percents) which are empty if not requested.
+    """
+    n = len(price) if with_transactions else 0
+    long_positions = np.empty(n, dtype=np.int64)
+    long_values = np.empty((4, n), dtype=np.float64)
+    short_positions = np.empty(n, dtype=np.int64)
+    short_values = np.empty((4, n), dtype=np.float64)
+
+    is_buy_mode = True
+
+    long_profit = 0.0
+    long_profit_percent = 0.0
+    long_transactions = 0
+    long_profitable = 0
+    long_last_price = 0.0  # Price of the last sell transaction
+
+    short_profit = 0.0
+    short_profit_percent = 0.0
+    short_transactions = 0
+    short_profitable = 0
+    short_last_price = 0.0  # Price of the last buy transaction
+
+    for i in range(len(price)):
+        p = price[i]
+        if p == 0.0 or np.isnan(p):
+            continue
+        if is_buy_mode:
+            if buy_signal[i]:
+                previous_price = short_last_price
+                profit = (previous_price - p) if previous_price > 0 else 0.0
+                profit_percent = 100.0 * profit / previous_price if previous_price > 0 else 0.0
+                short_profit += profit
+                short_profit_percent += profit_percent
+                if profit > 0:
+                    short_profitable += 1
+                if with_transactions:
+                    short_positions[short_transactions] = i
+                    short_values[0, short_transactions] = previous_price
+                    short_values[1, short_transactions] = p
+                    short_values[2, short_transactions] = profit
+                    short_values[3, short_transactions] = profit_percent
+                short_transactions += 1
+                short_last_price = p
+                is_buy_mode = False
+        else:
+            if sell_signal[i]:
+                previous_price = long_last_price
+                profit = (p - previous_price) if previous_price > 0 else 0.0
+                profit_percent = 100.0 * profit / previous_price if previous_price > 0 else 0.0
+                long_profit += profit
+                long_profit_percent += profit_percent
+                if profit > 0:
+                    long_profitable += 1
+                if with_transactions:
+                    long_positions[long_transactions] = i
+                    long_values[0, long_transactions] = previous_price
+                    long_values[1, long_transactions] = p
+                    long_values[2, long_transactions] = profit
+                    long_values[3, long_transactions] = profit_percent
+                long_transactions += 1
+                long_last_price = p
+                is_buy_mode = True
+
+    m = long_transactions if with_transactions else 0
+    longs = (long_positions[:m], long_values[0, :m], long_values[1, :m], long_values[2, :m], long_values[3, :m])
+    m = short_transactions if with_transactions else 0
+    shorts = (short_positions[:m], short_values[0, :m], short_values[1, :m], short_values[2, :m], short_values[3, :m])
+
+    long_stats = (long_profit, long_profit_percent, long_transactions, long_profitable)
+    short_stats = (short_profit, short_profit_percent, short_transactions, short_profitable)
+
+    return long_stats, short_stats, longs, shorts
+
+
+@njit(parallel=True, cache=True)
+def _simulate_threshold_grid(score, score_2, price, thresholds, has_score_2):
+    """
+    Simulate trades for each row of thresholds (buy, sell, buy 2, sell 2) in parallel.
+    The signals are the same as those of the threshold_rule and threshold_rule2 generators (comparisons with NaN are false).
+    """
+    m = thresholds.shape[0]
+    float_stats = np.zeros((m, 4), dtype=np.float64)  # Long profit, long profit percent, short profit, short profit percent
+    int_stats = np.zeros((m, 4), dtype=np.int64)  # Long transactions, long profitable, short transactions, short profitable
+
+    for g in prange(m):
+        buy_signal = score >= thresholds[g, 0]
+        sell_signal = score <= thresholds[g, 1]
+        if has_score_2:
+            buy_signal = buy_signal & (score_2 >= thresholds[g, 2])
+            sell_signal = sell_signal & (score_2 <= thresholds[g, 3])
+
+        long_stats, short_stats, longs, shorts = _simulate_trades(sell_signal, buy_signal, price, False)
+
+        float_stats[g, 0] = long_stats[0]
+        float_stats[g, 1] = long_stats[1]
+        float_stats[g, 2] = short_stats[0]
+        float_stats[g, 3] = short_stats[1]
+        int_stats[g, 0] = long_stats[2]
+        int_stats[g, 1] = long_stats[3]
+        int_stats[g, 2] = short_stats[2]
+        int_stats[g, 3] = short_stats[3]
+
+    return float_stats, int_stats
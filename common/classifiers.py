@@ -1,28 +1,41 @@
 from typing import List
+import sys
+import time
+import importlib
+import hashlib
+import weakref
 
 import numpy as np
 import pandas as pd
 
-from sklearn.model_selection import train_test_split
-from sklearn import metrics
-from sklearn.model_selection import ParameterGrid
-from sklearn.preprocessing import StandardScaler
-from sklearn.metrics import precision_score
-from sklearn.metrics import recall_score
-from sklearn.metrics import f1_score
+#
+# Algorithm libraries (sklearn, lightgbm, tensorflow/keras) are imported only when an algorithm of this type is really used.
+# Importing all of them takes several seconds and much memory which are not needed, e.g., if the server uses only lc models.
+#
+
+import_times = {}  # Seconds spent on (lazy) importing of each library
+
+
+def lazy_import(name: str):
+    """Import the module (if not imported yet) and record the time spent on this import."""
+    if name in sys.modules:
+        return importlib.import_module(name)  # Waits if the module is still being imported by another thread
+
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_times.setdefault(name, time.perf_counter() - start)
 
-from sklearn.linear_model import LogisticRegression, SGDClassifier
-from sklearn.svm import SVC
+    return module
 
-import lightgbm as lgbm
 
-import tensorflow as tf
-from tensorflow import keras
-from keras.optimizers import *
-from keras.models import Sequential
-from keras.layers import Dense, Dropout
-from keras.regularizers import *
-from keras.callbacks import *
+def print_import_times():
+    """Print the time spent on (lazy) imports of the algorithm libraries which have been used."""
+    if not import_times:
+        return
+    print("Import times of the algorithm libraries:")
+    for module_name, seconds in import_times.items():
+        print(f"  {module_name}: {seconds:.2f} seconds")
+
 
 #
 # GB
@@ -47,21 +60,19 @@ def train_gb(df_X, df_y, model_config: dict):
     shifts = model_config.get("train", {}).get("shifts", None)
     if shifts:
         max_shift = max(shifts)
-        df_X = double_columns(df_X, shifts)
-        df_X = df_X.iloc[max_shift:]
+        X_train = lagged_matrix(df_X.values, shifts)[max_shift:]
         df_y = df_y.iloc[max_shift:]
+    else:
+        X_train = df_X.values
 
     #
     # Scale
     #
     is_scale = model_config.get("train", {}).get("is_scale", False)
     if is_scale:
-        scaler = StandardScaler()
-        scaler.fit(df_X)
-        X_train = scaler.transform(df_X)
+        scaler, X_train = scale_train_matrix(X_train, _feature_matrix_key(df_X, shifts))
     else:
         scaler = None
-        X_train = df_X.values
 
     y_train = df_y.values
 
@@ -85,7 +96,7 @@ def train_gb(df_X, df_y, model_config: dict):
         #"n_estimators": 10000,
 
         #"min_split_gain": params['min_split_gain'],
-        "min_data_in_leaf": int(0.01*len(df_X)),  # Best: ~0.02 * len() - 2% of size
+        "min_data_in_leaf": int(0.01*len(X_train)),  # Best: ~0.02 * len() - 2% of size
         #'subsample': 0.8,
         #'colsample_bytree': 0.8,
         'num_leaves': 32,  # or (2 * 2**max_depth)
@@ -109,9 +120,20 @@ def train_gb(df_X, df_y, model_config: dict):
         'verbose': 0,
     }
 
+    num_threads = model_config.get("train", {}).get("num_threads")  # Thread budget of one job if models are trained in parallel
+    if num_threads:
+        lgbm_params["num_threads"] = num_threads
+
+    # Reuse the binned data set if the same feature matrix was already used for another label
+    # The parameters are part of the key because data set parameters (like min_data_in_leaf) are fixed when it is constructed
+    reuse_bins = model_config.get("train", {}).get("reuse_bins", False)
+    feature_key = (tuple(df_X.columns), tuple(shifts or []), is_scale, repr(sorted(lgbm_params.items())))
+    train_set = get_gb_dataset(X_train, y_train, feature_key, _content_key(df_X), lgbm_params, reuse_bins)
+
+    lgbm = lazy_import("lightgbm")
     model = lgbm.train(
         lgbm_params,
-        train_set=lgbm.Dataset(X_train, y_train),
+        train_set=train_set,
         num_boost_round=num_boost_round,
         #valid_sets=[lgbm.Dataset(X_validate, y_validate)],
         #early_stopping_rounds=int(num_boost_round / 5),
@@ -126,37 +148,47 @@ def predict_gb(models: tuple, df_X_test, model_config: dict):
     Use the model(s) to make predictions for the test data.
     The first model is a prediction model and the second model (optional) is a scaler.
     """
-    #
-    # Double column set if required
-    #
-    shifts = model_config.get("train", {}).get("shifts", None)
-    if shifts:
-        df_X_test = double_columns(df_X_test, shifts)
+    y_test_hat = predict_array("gb", models, df_X_test, model_config)
+    return pd.Series(data=y_test_hat, index=df_X_test.index, name="y_hat")  # NaNs where input is NaN
 
-    #
-    # Scale
-    #
-    scaler = models[1]
-    is_scale = scaler is not None
 
-    input_index = df_X_test.index
-    if is_scale:
-        df_X_test = scaler.transform(df_X_test)
-        df_X_test = pd.DataFrame(data=df_X_test, index=input_index)
-    else:
-        df_X_test = df_X_test
+#
+# Cache of binned data sets.
+# Binning (computing histograms) of the feature matrix is the most expensive part of creating a LightGBM data set.
+# It does not depend on the label and hence it is done once per feature matrix and then shared by all labels.
+#
 
-    df_X_test_nonans = df_X_test.dropna()  # Drop nans, possibly create gaps in index
-    nonans_index = df_X_test_nonans.index
+gb_dataset_cache = {}  # Key is a feature set key and value is a pair (content key, constructed lgbm.Dataset)
 
-    y_test_hat_nonans = models[0].predict(df_X_test_nonans.values)
-    y_test_hat_nonans = pd.Series(data=y_test_hat_nonans, index=nonans_index)  # Attach indexes with gaps
 
-    df_ret = pd.DataFrame(index=input_index)  # Create empty dataframe with original index
-    df_ret["y_hat"] = y_test_hat_nonans  # Join using indexes
-    sr_ret = df_ret["y_hat"]  # This series has all original input indexes but NaNs where input is NaN
+def get_gb_dataset(X_train, y_train, feature_key: tuple, content_key: tuple, params: dict, reuse_bins: bool = False):
+    """
+    Return a constructed (binned) LightGBM data set for the specified feature matrix and labels.
+
+    If the data set for the same feature set and rows is in the cache then only its label vector is replaced.
+    Otherwise, a new data set is created. If reuse_bins is true, then the bin mappers of the previous data set
+    for this feature set (e.g., from the previous step of rolling predictions) are reused via reference.
+    Only the latest data set for each feature set is cached.
+    """
+    cached = gb_dataset_cache.get(feature_key)
+    if cached is not None and cached[0] == content_key:
+        dataset = cached[1]
+        dataset.set_label(y_train)
+        return dataset
+
+    reference = cached[1] if cached is not None and reuse_bins else None
+    # Data set parameters (like min_data_in_leaf used for pre-filtering features) cannot be changed after construction
+    lgbm = lazy_import("lightgbm")
+    dataset = lgbm.Dataset(X_train, y_train, reference=reference, params=params).construct()
+
+    gb_dataset_cache[feature_key] = (content_key, dataset)
+
+    return dataset
 
-    return sr_ret
+
+def clear_gb_dataset_cache():
+    """Free memory used by the cached binned data sets."""
+    gb_dataset_cache.clear()
 
 
 #
@@ -182,21 +214,19 @@ def train_nn(df_X, df_y, model_config: dict):
     shifts = model_config.get("train", {}).get("shifts", None)
     if shifts:
         max_shift = max(shifts)
-        df_X = double_columns(df_X, shifts)
-        df_X = df_X.iloc[max_shift:]
+        X_train = lagged_matrix(df_X.values, shifts)[max_shift:]
         df_y = df_y.iloc[max_shift:]
+    else:
+        X_train = df_X.values
 
     #
     # Scale
     #
     is_scale = model_config.get("train", {}).get("is_scale", True)
     if is_scale:
-        scaler = StandardScaler()
-        scaler.fit(df_X)
-        X_train = scaler.transform(df_X)
+        scaler, X_train = scale_train_matrix(X_train, _feature_matrix_key(df_X, shifts))
     else:
         scaler = None
-        X_train = df_X.values
 
     y_train = df_y.values
 
@@ -215,8 +245,14 @@ def train_nn(df_X, df_y, model_config: dict):
     n_epochs = params.get("n_epochs")
     batch_size = params.get("bs")
 
+    # Global Keras state created by previous models is not needed anymore (important if models are trained in a loop)
+    reset_nn_runtime()
+
+    tf = lazy_import("tensorflow")
+    keras = lazy_import("keras")
+
     # Topology
-    model = Sequential()
+    model = keras.models.Sequential()
     # sigmoid, relu, tanh, selu, elu, exponential
     # kernel_regularizer=l2(0.001)
 
@@ -224,13 +260,13 @@ def train_nn(df_X, df_y, model_config: dict):
 
     for i, out_features in enumerate(layers):
         in_features = n_features if i == 0 else layers[i-1]
-        model.add(Dense(out_features, activation='sigmoid', input_dim=in_features))  # , kernel_regularizer=l2(reg_l2)
+        model.add(keras.layers.Dense(out_features, activation='sigmoid', input_dim=in_features))  # , kernel_regularizer=l2(reg_l2)
         #model.add(Dropout(rate=0.5))
 
-    model.add(Dense(1, activation='sigmoid'))
+    model.add(keras.layers.Dense(1, activation='sigmoid'))
 
     # Compile model
-    optimizer = Adam(learning_rate=learning_rate)
+    optimizer = keras.optimizers.Adam(learning_rate=learning_rate)
     model.compile(
         loss='binary_crossentropy',
         optimizer=optimizer,
@@ -242,7 +278,7 @@ def train_nn(df_X, df_y, model_config: dict):
     )
     #model.summary()
 
-    es = EarlyStopping(
+    es = keras.callbacks.EarlyStopping(
         monitor="loss",  # val_loss loss
         min_delta=0.001,  # Minimum change qualified as improvement
         patience=1,  # Number of epochs with no improvements
@@ -273,42 +309,8 @@ def predict_nn(models: tuple, df_X_test, model_config: dict):
     Use the model(s) to make predictions for the test data.
     The first model is a prediction model and the second model (optional) is a scaler.
     """
-    #
-    # Double column set if required
-    #
-    shifts = model_config.get("train", {}).get("shifts", None)
-    if shifts:
-        df_X_test = double_columns(df_X_test, shifts)
-
-    #
-    # Scale
-    #
-    scaler = models[1]
-    is_scale = scaler is not None
-
-    input_index = df_X_test.index
-    if is_scale:
-        df_X_test = scaler.transform(df_X_test)
-        df_X_test = pd.DataFrame(data=df_X_test, index=input_index)
-    else:
-        df_X_test = df_X_test
-
-    df_X_test_nonans = df_X_test.dropna()  # Drop nans, possibly create gaps in index
-    nonans_index = df_X_test_nonans.index
-
-    # Resets all (global) state generated by Keras
-    # Important if prediction is executed in a loop to avoid memory leak
-    tf.keras.backend.clear_session()
-
-    y_test_hat_nonans = models[0].predict_on_batch(df_X_test_nonans.values)  # NN returns matrix with one column as prediction
-    y_test_hat_nonans = y_test_hat_nonans[:, 0]  # Or y_test_hat.flatten()
-    y_test_hat_nonans = pd.Series(data=y_test_hat_nonans, index=nonans_index)  # Attach indexes with gaps
-
-    df_ret = pd.DataFrame(index=input_index)  # Create empty dataframe with original index
-    df_ret["y_hat"] = y_test_hat_nonans  # Join using indexes
-    sr_ret = df_ret["y_hat"]  # This series has all original input indexes but NaNs where input is NaN
-
-    return sr_ret
+    y_test_hat = predict_array("nn", models, df_X_test, model_config)
+    return pd.Series(data=y_test_hat, index=df_X_test.index, name="y_hat")  # NaNs where input is NaN
 
 
 #
@@ -334,21 +336,19 @@ def train_lc(df_X, df_y, model_config: dict):
     shifts = model_config.get("train", {}).get("shifts", None)
     if shifts:
         max_shift = max(shifts)
-        df_X = double_columns(df_X, shifts)
-        df_X = df_X.iloc[max_shift:]
+        X_train = lagged_matrix(df_X.values, shifts)[max_shift:]
         df_y = df_y.iloc[max_shift:]
+    else:
+        X_train = df_X.values
 
     #
     # Scale
     #
     is_scale = model_config.get("train", {}).get("is_scale", True)
     if is_scale:
-        scaler = StandardScaler()
-        scaler.fit(df_X)
-        X_train = scaler.transform(df_X)
+        scaler, X_train = scale_train_matrix(X_train, _feature_matrix_key(df_X, shifts))
     else:
         scaler = None
-        X_train = df_X.values
 
     y_train = df_y.values
 
@@ -356,9 +356,10 @@ def train_lc(df_X, df_y, model_config: dict):
     # Create model
     #
     args = model_config.get("params").copy()
-    args["n_jobs"] = -1
+    args["n_jobs"] = model_config.get("train", {}).get("num_threads") or -1
     args["verbose"] = 0
-    model = LogisticRegression(**args)
+    linear_model = lazy_import("sklearn.linear_model")
+    model = linear_model.LogisticRegression(**args)
 
     #
     # Train
@@ -373,38 +374,8 @@ def predict_lc(models: tuple, df_X_test, model_config: dict):
     Use the model(s) to make predictions for the test data.
     The first model is a prediction model and the second model (optional) is a scaler.
     """
-    #
-    # Double column set if required
-    #
-    shifts = model_config.get("train", {}).get("shifts", None)
-    if shifts:
-        df_X_test = double_columns(df_X_test, shifts)
-
-    #
-    # Scale
-    #
-    scaler = models[1]
-    is_scale = scaler is not None
-
-    input_index = df_X_test.index
-    if is_scale:
-        df_X_test = scaler.transform(df_X_test)
-        df_X_test = pd.DataFrame(data=df_X_test, index=input_index)
-    else:
-        df_X_test = df_X_test
-
-    df_X_test_nonans = df_X_test.dropna()  # Drop nans, possibly create gaps in index
-    nonans_index = df_X_test_nonans.index
-
-    y_test_hat_nonans = models[0].predict_proba(df_X_test_nonans.values)  # It returns pairs or probas for 0 and 1
-    y_test_hat_nonans = y_test_hat_nonans[:, 1]  # Or y_test_hat.flatten()
-    y_test_hat_nonans = pd.Series(data=y_test_hat_nonans, index=nonans_index)  # Attach indexes with gaps
-
-    df_ret = pd.DataFrame(index=input_index)  # Create empty dataframe with original index
-    df_ret["y_hat"] = y_test_hat_nonans  # Join using indexes
-    sr_ret = df_ret["y_hat"]  # This series has all original input indexes but NaNs where input is NaN
-
-    return sr_ret
+    y_test_hat = predict_array("lc", models, df_X_test, model_config)
+    return pd.Series(data=y_test_hat, index=df_X_test.index, name="y_hat")  # NaNs where input is NaN
 
 
 #
@@ -424,18 +395,25 @@ def train_svc(df_X, df_y, model_config: dict):
     """
     Train model with the specified hyper-parameters and return this model (and scaler if any).
     """
-    is_scale = model_config.get("train", {}).get("is_scale", True)
+    #
+    # Double column set if required
+    #
+    shifts = model_config.get("train", {}).get("shifts", None)
+    if shifts:
+        max_shift = max(shifts)
+        X_train = lagged_matrix(df_X.values, shifts)[max_shift:]
+        df_y = df_y.iloc[max_shift:]
+    else:
+        X_train = df_X.values
 
     #
-    # Prepare data
+    # Scale
     #
+    is_scale = model_config.get("train", {}).get("is_scale", True)
     if is_scale:
-        scaler = StandardScaler()
-        scaler.fit(df_X)
-        X_train = scaler.transform(df_X)
+        scaler, X_train = scale_train_matrix(X_train, _feature_matrix_key(df_X, shifts))
     else:
         scaler = None
-        X_train = df_X.values
 
     y_train = df_y.values
 
@@ -443,54 +421,259 @@ def train_svc(df_X, df_y, model_config: dict):
     # Create model
     #
     args = model_config.get("params").copy()
-    args['probability'] = True  # Required if we are going to use predict_proba()
-    model = SVC(**args)
+    approximation = args.pop("approximation", None)
+    if approximation:
+        model = create_approximate_svc(approximation, args)
+    else:
+        args['probability'] = True  # Required if we are going to use predict_proba()
+        svm = lazy_import("sklearn.svm")
+        model = svm.SVC(**args)
 
     #
     # Train
     #
+    start = time.perf_counter()
     model.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    if approximation:
+        metrics = lazy_import("sklearn.metrics")
+        auc = metrics.roc_auc_score(y_train, model.predict_proba(X_train)[:, 1])
+        print(f"Trained SVC with '{approximation}' kernel approximation in {fit_time:.2f} seconds. Rows: {len(X_train)}. Train AUC: {auc:.3f}")
 
     return (model, scaler)
 
 
+# Parameters of each kernel approximation. Other (e.g., SVC specific) parameters are rejected because they would be ignored
+approximation_parameters = {
+    "nystroem": ["n_components", "kernel", "gamma", "degree", "coef0", "C", "max_iter", "random_state"],
+    "rff": ["n_components", "kernel", "gamma", "C", "max_iter", "random_state"],
+}
+
+
+def create_approximate_svc(approximation: str, args: dict):
+    """
+    Create a pipeline which maps the data to an approximate kernel feature space and then trains a linear classifier.
+    Training time is linear in the number of rows as opposed to SVC which is unusable for large training sets.
+
+    approximation: "nystroem" (kernel map learned from a sample of rows) or "rff" (random Fourier features, RBF kernel only)
+    args: n_components (dimension of the feature space), kernel, gamma, degree and coef0 (nystroem only), C, max_iter, random_state
+    """
+    if approximation not in approximation_parameters:
+        raise ValueError(f"Unknown kernel approximation '{approximation}'. Use 'nystroem' or 'rff'.")
+    unsupported = [name for name in args if name not in approximation_parameters[approximation]]
+    if unsupported:
+        raise ValueError(f"Parameters {unsupported} are not supported by the '{approximation}' kernel approximation. Supported parameters: {approximation_parameters[approximation]}")
+    if approximation == "rff" and args.get("kernel", "rbf") != "rbf":
+        raise ValueError(f"Kernel '{args.get('kernel')}' is not supported by the 'rff' kernel approximation. Only 'rbf' kernel can be approximated by random Fourier features.")
+
+    kernel_approximation = lazy_import("sklearn.kernel_approximation")
+    linear_model = lazy_import("sklearn.linear_model")
+    pipeline = lazy_import("sklearn.pipeline")
+
+    n_components = args.get("n_components", 500)
+    gamma = args.get("gamma", "scale")  # Same default as in SVC
+    random_state = args.get("random_state", 0)
+
+    if approximation == "nystroem":
+        kernel = args.get("kernel", "rbf")
+        if gamma == "scale":
+            gamma = None  # Nystroem default (1 / n_features) is equal to "scale" for scaled data
+        kernel_map = kernel_approximation.Nystroem(
+            kernel=kernel, gamma=gamma, degree=args.get("degree"), coef0=args.get("coef0"),
+            n_components=n_components, random_state=random_state,
+        )
+    else:
+        kernel_map = kernel_approximation.RBFSampler(gamma=gamma, n_components=n_components, random_state=random_state)
+
+    classifier = linear_model.LogisticRegression(C=args.get("C", 1.0), max_iter=args.get("max_iter", 200))
+
+    return pipeline.Pipeline([("kernel_map", kernel_map), ("classifier", classifier)])
+
+
 def predict_svc(models: tuple, df_X_test, model_config: dict):
     """
     Use the model(s) to make predictions for the test data.
     The first model is a prediction model and the second model (optional) is a scaler.
     """
-    #
-    # Double column set if required
-    #
+    y_test_hat = predict_array("svc", models, df_X_test, model_config)
+    return pd.Series(data=y_test_hat, index=df_X_test.index, name="y_hat")  # NaNs where input is NaN
+
+
+#
+# Training
+#
+
+algorithm_types = ["gb", "nn", "lc", "svc"]  # Algorithm types supported by train_model and predict_array
+
+
+def train_model(algo_type: str, df_X, df_y, model_config: dict) -> tuple:
+    """Train a model pair (prediction model and optional scaler) of the specified algorithm type."""
+    if algo_type == "gb":
+        return train_gb(df_X, df_y, model_config)
+    elif algo_type == "nn":
+        return train_nn(df_X, df_y, model_config)
+    elif algo_type == "lc":
+        return train_lc(df_X, df_y, model_config)
+    elif algo_type == "svc":
+        return train_svc(df_X, df_y, model_config)
+    else:
+        raise ValueError(f"Unknown algorithm type '{algo_type}'")
+
+
+#
+# Inference
+#
+
+def predict_array(algo_type: str, models: tuple, df_X_test, model_config: dict) -> np.ndarray:
+    """
+    Apply the model pair (prediction model and optional scaler) of the specified algorithm type to the test data.
+    Return a numpy array with one score for each input row and NaN for rows with NaN in the input.
+    """
+    X_test = prepare_predict_matrix(models[1], df_X_test, model_config)
+
+    predict_fn = get_predict_function(algo_type, models[0])
+
+    return predict_nonans(predict_fn, X_test)
+
+
+def get_predict_function(algo_type: str, model):
+    """Return a function which maps a (prepared) feature matrix without NaNs to an array of scores."""
+    if algo_type == "gb":
+        return model.predict
+    elif algo_type == "nn":
+        return lambda X: _predict_nn_batch(model, X)
+    elif algo_type == "lc" or algo_type == "svc":
+        return lambda X: model.predict_proba(X)[:, 1]  # It returns pairs or probas for 0 and 1
+    else:
+        raise ValueError(f"Unknown algorithm type '{algo_type}'")
+
+
+def predict_fused(model_list: list, X: np.ndarray, latencies: dict = None) -> np.ndarray:
+    """
+    Apply many models to the same feature matrix and return a matrix with one column of scores for each model.
+
+    The models are grouped by their preprocessing (shifts and scaler parameters) so that each different transformation
+    of the input matrix and its NaN mask are computed only once. All scores are written into one preallocated array.
+
+    :param model_list: list of tuples (score column name, algorithm type, model pair, model config)
+    :param X: feature matrix (not shifted and not scaled)
+    :param latencies: if not None, then prediction time in seconds is stored for each score column name
+    """
+    X = np.asarray(X, dtype=float)
+    out = np.full((len(X), len(model_list)), np.nan)
+
+    groups = {}  # Key is preprocessing and value is a list of column numbers
+    for i, (score_column_name, algo_type, model_pair, model_config) in enumerate(model_list):
+        shifts = model_config.get("train", {}).get("shifts", None)
+        scaler = model_pair[1]
+        scaler_key = (scaler.mean_.tobytes(), scaler.scale_.tobytes()) if scaler is not None else None
+        groups.setdefault((tuple(shifts or []), scaler_key), []).append(i)
+
+    for (shifts, scaler_key), columns in groups.items():
+        start = time.perf_counter()
+        X_group = lagged_matrix(X, list(shifts)) if shifts else X
+        scaler = model_list[columns[0]][2][1]  # Scalers within the group have equal parameters
+        if scaler is not None:
+            X_group = scaler.transform(X_group)
+        valid = ~np.isnan(X_group).any(axis=1)
+        all_valid = valid.all()
+        if not all_valid:
+            X_group = X_group[valid]
+        prepare_time = (time.perf_counter() - start) / len(columns)  # Shared by all models of the group
+
+        for i in columns:
+            score_column_name, algo_type, model_pair, model_config = model_list[i]
+            start = time.perf_counter()
+            if len(X_group) > 0:
+                predict_fn = get_predict_function(algo_type, model_pair[0])
+                if all_valid:
+                    out[:, i] = predict_fn(X_group)
+                else:
+                    out[valid, i] = predict_fn(X_group)
+            if latencies is not None:
+                latencies[score_column_name] = prepare_time + time.perf_counter() - start
+
+    return out
+
+
+def prepare_predict_matrix(scaler, df_X_test, model_config: dict) -> np.ndarray:
+    """Convert the test data to the matrix expected by the model by adding shifted columns and scaling."""
     shifts = model_config.get("train", {}).get("shifts", None)
     if shifts:
-        df_X_test = double_columns(df_X_test, shifts)
+        X_test = lagged_matrix(df_X_test.values, shifts)
+    else:
+        X_test = df_X_test.values
 
-    #
-    # Scale
-    #
-    scaler = models[1]
-    is_scale = scaler is not None
+    if scaler is not None:
+        X_test = scale_predict_matrix(scaler, X_test, _feature_matrix_key(df_X_test, shifts))
 
-    input_index = df_X_test.index
-    if is_scale:
-        df_X_test = scaler.transform(df_X_test)
-        df_X_test = pd.DataFrame(data=df_X_test, index=input_index)
-    else:
-        df_X_test = df_X_test
+    return X_test
+
+
+def predict_nonans(predict_fn, X: np.ndarray) -> np.ndarray:
+    """
+    Apply the prediction function only to rows without NaNs and scatter its predictions into an output
+    array with the original length. Rows with NaNs in the input get NaN in the output.
+    """
+    X = np.asarray(X, dtype=float)
+    valid = ~np.isnan(X).any(axis=1)
+
+    if valid.all():
+        return np.asarray(predict_fn(X), dtype=float)
+
+    y_hat = np.full(len(X), np.nan)
+    if valid.any():
+        y_hat[valid] = predict_fn(X[valid])
+
+    return y_hat
 
-    df_X_test_nonans = df_X_test.dropna()  # Drop nans, possibly create gaps in index
-    nonans_index = df_X_test_nonans.index
 
-    y_test_hat_nonans = models[0].predict_proba(df_X_test_nonans.values)  # It returns pairs or probas for 0 and 1
-    y_test_hat_nonans = y_test_hat_nonans[:, 1]  # Or y_test_hat.flatten()
-    y_test_hat_nonans = pd.Series(data=y_test_hat_nonans, index=nonans_index)  # Attach indexes with gaps
+def _predict_nn_batch(model, X: np.ndarray) -> np.ndarray:
+    tf = lazy_import("tensorflow")
+    infer_fn = get_nn_inference_function(model)
+    y_hat = infer_fn(tf.convert_to_tensor(X, dtype=tf.float32))  # NN returns matrix with one column as prediction
+    return y_hat.numpy()[:, 0]
 
-    df_ret = pd.DataFrame(index=input_index)  # Create empty dataframe with original index
-    df_ret["y_hat"] = y_test_hat_nonans  # Join using indexes
-    sr_ret = df_ret["y_hat"]  # This series has all original input indexes but NaNs where input is NaN
 
-    return sr_ret
+#
+# NN inference runtime.
+# Each model gets one compiled inference function with a fixed signature (any number of rows).
+# It is traced only once and then kept warm between calls, for example, between minutes in the server.
+# Global Keras state is not cleared on each prediction. Instead, it is reset explicitly when models are replaced.
+#
+
+nn_inference_functions = weakref.WeakKeyDictionary()  # Entries are removed when models are garbage collected
+
+
+def get_nn_inference_function(model):
+    """Return the compiled inference function for the model (create and cache it if it does not exist)."""
+    infer_fn = nn_inference_functions.get(model)
+    if infer_fn is not None:
+        return infer_fn
+
+    tf = lazy_import("tensorflow")
+    model_ref = weakref.ref(model)  # Functions must not keep their (cache key) models alive
+    n_features = model.input_shape[-1]
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=[None, n_features], dtype=tf.float32)])
+    def infer_fn(X):
+        return model_ref()(X, training=False)
+
+    nn_inference_functions[model] = infer_fn
+
+    return infer_fn
+
+
+def reset_nn_runtime():
+    """
+    Drop all compiled inference functions and reset global Keras state.
+    It has to be called when a set of NN models is replaced (e.g., new models are loaded or trained in a loop)
+    in order to avoid accumulating memory.
+    """
+    nn_inference_functions.clear()
+    if "tensorflow" in sys.modules:  # Nothing to reset if no NN models have been used
+        sys.modules["tensorflow"].keras.backend.clear_session()
 
 
 #
@@ -498,17 +681,21 @@ def predict_svc(models: tuple, df_X_test, model_config: dict):
 #
 
 def compute_scores(y_true, y_hat):
-    """Compute several scores and return them as dict."""
+    """Compute several scores and return them as dict. Predictions can be a series or an array (possibly with NaNs)."""
     y_true = y_true.astype(int)
-    y_hat_class = np.where(y_hat.values > 0.5, 1, 0)
+    y_hat = np.asarray(y_hat, dtype=float)
+    y_hat_class = np.where(y_hat > 0.5, 1, 0)
+    y_hat_nonans = np.where(np.isnan(y_hat), 0.0, y_hat)
+
+    metrics = lazy_import("sklearn.metrics")
 
     try:
-        auc = metrics.roc_auc_score(y_true, y_hat.fillna(value=0))
+        auc = metrics.roc_auc_score(y_true, y_hat_nonans)
     except ValueError:
         auc = 0.0  # Only one class is present (if dataset is too small, e.g,. when debugging) or Nulls in predictions
 
     try:
-        ap = metrics.average_precision_score(y_true, y_hat.fillna(value=0))
+        ap = metrics.average_precision_score(y_true, y_hat_nonans)
     except ValueError:
         ap = 0.0  # Only one class is present (if dataset is too small, e.g,. when debugging) or Nulls in predictions
 
@@ -527,15 +714,118 @@ def compute_scores(y_true, y_hat):
     return scores
 
 
+#
+# Cache of fitted scalers and scaled matrices.
+# Models for different labels and algorithms are normally trained (and applied) using the same feature matrix.
+# Hence the scaling is computed once and the scaled matrix is shared by all these models.
+# The matrices are not modified by the algorithms.
+#
+
+scaler_cache = {}  # Key is a feature matrix key and value is a pair (fitted scaler, scaled matrix)
+scaler_cache_size = 4  # Maximum number of (large) scaled matrices kept in memory
+
+
+def scale_train_matrix(X: np.ndarray, matrix_key: tuple = None):
+    """
+    Fit a standard scaler and scale the train matrix. Return both the scaler and the scaled matrix.
+    If the matrix with the same key has been already scaled then the cached scaler and scaled matrix are returned.
+    """
+    key = ("train", matrix_key)
+    cached = scaler_cache.get(key) if matrix_key is not None else None
+    if cached is not None:
+        return cached
+
+    scaler = lazy_import("sklearn.preprocessing").StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+
+    if matrix_key is not None:
+        _put_scaler_cache(key, (scaler, X_scaled))
+
+    return scaler, X_scaled
+
+
+def scale_predict_matrix(scaler, X: np.ndarray, matrix_key: tuple = None):
+    """
+    Scale the matrix using the fitted scaler. If the same matrix has been already scaled by a scaler
+    with the same parameters (e.g., scalers of models trained on the same data) then the cached result is returned.
+    """
+    key = ("predict", matrix_key, scaler.mean_.tobytes(), scaler.scale_.tobytes())
+    cached = scaler_cache.get(key) if matrix_key is not None else None
+    if cached is not None:
+        return cached[1]
+
+    X_scaled = scaler.transform(X)
+
+    if matrix_key is not None:
+        _put_scaler_cache(key, (scaler, X_scaled))
+
+    return X_scaled
+
+
+def _put_scaler_cache(key, value):
+    scaler_cache[key] = value
+    while len(scaler_cache) > scaler_cache_size:
+        del scaler_cache[next(iter(scaler_cache))]  # Remove the oldest entry
+
+
+def clear_scaler_cache():
+    """Free memory used by the cached scaled matrices."""
+    scaler_cache.clear()
+
+
+def _feature_matrix_key(df_X: pd.DataFrame, shifts: List[int]):
+    """Identify a feature matrix by its columns, shifts applied to it and its rows."""
+    return (tuple(df_X.columns), tuple(shifts or []), _content_key(df_X))
+
+
+def _content_key(df: pd.DataFrame):
+    """Identify the rows of a feature matrix by the hash of all its index values and values."""
+    row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return (len(df), hashlib.blake2b(row_hashes.tobytes(), digest_size=16).hexdigest())
+
+
+def lagged_matrix(X: np.ndarray, shifts: List[int], out: np.ndarray = None) -> np.ndarray:
+    """
+    Return a matrix with the input columns followed by the same columns shifted by each of the shifts.
+    The shifts have the same semantics as in DataFrame.shift, that is, positive shifts take values from previous rows
+    and the rows without history are NaN.
+
+    The output matrix is allocated only once (or the provided matrix is used) and the shifted blocks
+    are copied directly into it so that no intermediate shifted copies are created.
+    """
+    if X.ndim == 1:
+        X = X.reshape(-1, 1)
+    n_rows, n_cols = X.shape
+
+    shape = (n_rows, n_cols * (len(shifts) + 1))
+    if out is None:
+        out = np.empty(shape, dtype=np.result_type(X.dtype, np.float32))
+    elif out.shape != shape:
+        raise ValueError(f"Wrong shape of the output matrix for lagged features {out.shape}. Expected shape {shape}")
+
+    out[:, :n_cols] = X
+    for i, shift in enumerate(shifts, start=1):
+        block = out[:, i*n_cols:(i+1)*n_cols]  # View
+        shift = min(shift, n_rows) if shift >= 0 else max(shift, -n_rows)
+        if shift > 0:
+            block[:shift] = np.nan
+            block[shift:] = X[:n_rows-shift]
+        elif shift < 0:
+            block[shift:] = np.nan
+            block[:shift] = X[-shift:]
+        else:
+            block[:] = X
+
+    return out
+
+
 def double_columns(df, shifts: List[int]):
+    """Add shifted copies of all columns to the data frame. The shifted columns have the same names."""
     if not shifts:
         return df
-    df_list = [df.shift(shift) for shift in shifts]
-    df_list.insert(0, df)
-    max_shift = max(shifts)
 
-    # Shift and add same columns
-    df_out = pd.concat(df_list, axis=1)  # keys=('A', 'B')
+    X = lagged_matrix(df.values, shifts)
+    df_out = pd.DataFrame(X, index=df.index, columns=df.columns.to_list() * (len(shifts) + 1))
 
     return df_out
 
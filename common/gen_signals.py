@@ -17,7 +17,7 @@ given parameters, and 2) finding optimal parameters of rules (currently via grid
 """
 
 
-def generate_smoothen_scores(df, config: dict):
+def generate_smoothen_scores(df, config: dict, last_rows: int = 0):
     """
     Smoothen several columns and rows. Used for smoothing scores.
 
@@ -26,6 +26,9 @@ def generate_smoothen_scores(df, config: dict):
         - find moving average with the specified window
         - apply threshold to source buy/sell column(s) according to threshold parameter(s) by producing a boolean column
 
+    If last_rows is specified (streaming mode), then the moving average is not recomputed. Instead, its state is stored
+    between calls and only the rows which are newer than the rows processed before are added to it.
+
     Notes:
         - Input point-wise scores in buy and sell columns are always positive
     """
@@ -40,6 +43,14 @@ def generate_smoothen_scores(df, config: dict):
     #if columns not in df.columns:
     #    raise ValueError(f"{columns} do not exist  in the input data. Existing columns: {df.columns.to_list()}")
 
+    names = config.get('names')
+    if not isinstance(names, str):
+        raise ValueError(f"'names' parameter must be a non-empty string. {type(names)}")
+
+    if last_rows:
+        df[names] = smoothen_scores_streaming(df, config, columns, names, last_rows)
+        return df, [names]
+
     # Average all buy and sell columns
     out_column = df[columns].mean(skipna=True, axis=1)
 
@@ -55,21 +66,189 @@ def generate_smoothen_scores(df, config: dict):
     elif isinstance(window, float):
         out_column = out_column.ewm(span=window, min_periods=window // 2, adjust=False).mean()
 
-    names = config.get('names')
-    if not isinstance(names, str):
-        raise ValueError(f"'names' parameter must be a non-empty string. {type(names)}")
-
     df[names] = out_column
 
     return df, [names]
 
 
-def generate_combine_scores(df, config: dict):
+#
+# Streaming smoothing
+#
+
+smoothen_states = {}  # Key is the output column name and value is the state of its streaming smoother
+
+
+def smoothen_scores_streaming(df, config: dict, columns: list, names: str, last_rows: int):
+    """
+    Return the smoothed column for the data frame by adding only its last rows to the state stored for this output column.
+    The last rows might have been processed before with other (not final) scores. Therefore, the state is restored from its
+    checkpoint before the first of the last rows (or before the first new row) and all following rows are processed again.
+    The state is (re)created from all rows if it does not exist, the configuration has changed or there is no such checkpoint.
+    The smoothed values are known only for the rows processed by this or previous calls (the last rows of the history), other rows are NaN.
+    """
+    key = (tuple(columns), config.get("point_threshold"), config.get("window"))
+    state = smoothen_states.get(names)
+    replay_from = state.find_replay_start(df, last_rows) if state is not None and state.key == key else None
+    if replay_from is None:
+        state = SmoothenState(key, config.get("window"), history=max(last_rows, 1))
+        smoothen_states[names] = state
+        new_df = df
+    else:
+        state.restore(replay_from)
+        new_df = df[df.index >= replay_from]
+    state.history = max(last_rows, 1)  # A state created from all rows (full analysis) then stores only the last rows
+
+    if len(new_df) > 0:
+        # Average all buy and sell columns and apply thresholds (if specified) only for the new rows
+        values = new_df[columns].mean(skipna=True, axis=1)
+        point_threshold = config.get("point_threshold")
+        if point_threshold:
+            values = values >= point_threshold
+
+        state.update(new_df.index, values.to_numpy(dtype=float))
+
+    return state.outputs.reindex(df.index)
+
+
+class SmoothenState:
+    """
+    State of the moving average which is updated in O(1) for each new value:
+    - int window: rolling mean of the last window values (at least window // 2 non-NaN values) computed from a running (Kahan) sum
+    - float window: exponential moving average with span window and adjust=False
+    After the warm-up, the values are equal to those of the rolling(...).mean() and ewm(...).mean() of pandas.
+    A checkpoint (copy of the variables) is stored after each of the last processed rows so that these rows can be processed again.
+    """
+
+    variables = ["buffer", "position", "sum", "compensation", "count", "weighted", "old_weight"]
+
+    def __init__(self, key, window, history: int):
+        self.key = key
+        self.window = window
+        self.history = history  # Number of the last smoothed values (and checkpoints) which are stored
+        self.outputs = pd.Series(dtype=float)
+        self.checkpoints = {}  # Row index and the variables after processing this row
+
+        if isinstance(window, int):
+            self.min_periods = window // 2
+            self.buffer = np.full(window, np.nan)  # Ring buffer with the last window values
+            self.position = 0
+            self.sum = 0.0
+            self.compensation = 0.0  # Lost low-order bits of the sum
+            self.count = 0  # Number of non-NaN values in the buffer
+        elif isinstance(window, float):
+            self.min_periods = max(int(window // 2), 1)
+            self.alpha = 2.0 / (window + 1.0)
+            self.weighted = np.nan
+            self.old_weight = 1.0
+            self.count = 0
+
+    def find_replay_start(self, df, last_rows: int):
+        """
+        Return the index of the first row to be processed: the first of the last rows or the first new row (if it is earlier).
+        Return None if the state cannot be continued (there is no checkpoint before this row or the rows are not contiguous).
+        """
+        if len(df) == 0 or not self.checkpoints:
+            return None
+        processed = list(self.checkpoints.keys())
+        last_index = processed[-1]
+        if last_index not in df.index:
+            return None  # The new rows do not continue the processed rows
+
+        first_changed = df.index[max(len(df) - last_rows, 0)]
+        first_new = df.index[df.index.get_loc(last_index) + 1] if df.index[-1] > last_index else None
+        replay_from = first_changed if first_new is None or first_changed < first_new else first_new
+
+        if replay_from == first_new:
+            return replay_from  # The checkpoint is the last processed row
+        position = processed.index(replay_from) if replay_from in self.checkpoints else 0
+        return replay_from if position > 0 else None
+
+    def restore(self, replay_from):
+        """Restore the variables from the checkpoint before the specified row and forget the outputs starting from this row."""
+        processed = list(self.checkpoints.keys())
+        position = processed.index(replay_from) if replay_from in self.checkpoints else len(processed)
+        checkpoint = self.checkpoints[processed[position - 1]]
+        for name, value in checkpoint.items():
+            setattr(self, name, value.copy() if isinstance(value, np.ndarray) else value)
+        for index in processed[position:]:
+            del self.checkpoints[index]
+        self.outputs = self.outputs[self.outputs.index < replay_from]
+
+    def update(self, index, values: np.ndarray):
+        if isinstance(self.window, int):
+            fn = self._update_rolling
+        elif isinstance(self.window, float):
+            fn = self._update_ewm
+        else:
+            fn = float  # No smoothing
+
+        # Checkpoints are needed only for the last rows
+        checkpoint_start = len(values) - self.history - 1
+        outputs = []
+        for i, x in enumerate(values):
+            outputs.append(fn(x))
+            if i >= checkpoint_start:
+                self.checkpoints[index[i]] = self._copy_variables()
+        outputs = pd.Series(outputs, index=index, dtype=float)
+
+        self.outputs = pd.concat([self.outputs, outputs]).tail(self.history) if len(self.outputs) else outputs.tail(self.history)
+        for old_index in list(self.checkpoints.keys())[:-self.history - 1]:
+            del self.checkpoints[old_index]
+
+    def _copy_variables(self):
+        variables = {}
+        for name in self.variables:
+            if hasattr(self, name):
+                value = getattr(self, name)
+                variables[name] = value.copy() if isinstance(value, np.ndarray) else value
+        return variables
+
+    def _add(self, x):
+        y = x - self.compensation
+        t = self.sum + y
+        self.compensation = (t - self.sum) - y
+        self.sum = t
+
+    def _update_rolling(self, x):
+        old = self.buffer[self.position]
+        if not np.isnan(old):
+            self._add(-old)
+            self.count -= 1
+        if not np.isnan(x):
+            self._add(x)
+            self.count += 1
+        self.buffer[self.position] = x
+        self.position = (self.position + 1) % self.window
+
+        if self.count == 0:
+            self.sum = 0.0  # Remove the accumulated error
+            self.compensation = 0.0
+            return np.nan
+        return self.sum / self.count if self.count >= self.min_periods else np.nan
+
+    def _update_ewm(self, x):
+        # The same recurrence as in pandas (adjust=False, ignore_na=False)
+        is_observation = not np.isnan(x)
+        self.count += is_observation
+        if not np.isnan(self.weighted):
+            self.old_weight *= 1.0 - self.alpha
+            if is_observation:
+                if self.weighted != x:
+                    self.weighted = (self.old_weight * self.weighted + self.alpha * x) / (self.old_weight + self.alpha)
+                self.old_weight = 1.0
+        elif is_observation:
+            self.weighted = x
+        return self.weighted if self.count >= self.min_periods else np.nan
+
+
+def generate_combine_scores(df, config: dict, last_rows: int = 0):
     """
     ML algorithms predict score which is always positive and typically within [0,1].
     One score for price growth and one score for price fall. This function combines pairs
     of such scores and produce one score within [-1,+1]. Positive values mean growth
     and negative values mean fall of price.
+
+    If last_rows is specified, then only these last rows are computed (other rows are NaN) which is used in streaming mode.
     """
     columns = config.get('columns')
     if not columns:
@@ -82,55 +261,42 @@ def generate_combine_scores(df, config: dict):
 
     out_column = config.get('names')
 
-    if config.get("combine") == "relative":
-        combine_scores_relative(df, up_column, down_column, out_column)
-    elif config.get("combine") == "difference":
-        combine_scores_difference(df, up_column, down_column, out_column)
-    else:
-        # If buy score is greater than sell score then positive buy, otherwise negative sell
-        df[out_column] = df[[up_column, down_column]].apply(lambda x: x[0] if x[0] >= x[1] else -x[1], raw=True, axis=1)
+    rows = slice(-last_rows, None) if last_rows else slice(None)
+    up = df[up_column].to_numpy(dtype=float)[rows]
+    down = df[down_column].to_numpy(dtype=float)[rows]
+
+    out = combine_scores(up, down, config.get("combine"))
 
     # Scale the score distribution to make it symmetric or normalize
     # Always apply the transformation to buy score. It might be in [0,1] or [-1,+1] depending on combine parameter
     if config.get("coefficient"):
-        df[out_column] = df[out_column] * config.get("coefficient")
+        out = out * config.get("coefficient")
     if config.get("constant"):
-        df[out_column] = df[out_column] + config.get("constant")
-
-    return df, [out_column]
-
-
-def combine_scores_relative(df, buy_column, sell_column, trade_column_out):
-    """
-    Mutually adjust input buy and sell scores by producing two output scores.
-    The idea is that if both scores (buy and sell) are equally high then in the output
-    they both will be 0. The output score describe if this score is higher relative to the other.
-    The two output scores are in [-1, +1] but have opposite values.
-    """
+        out = out + config.get("constant")
 
-    # compute proportion in the sum
-    buy_plus_sell = df[buy_column] + df[sell_column]
-    buy_sell_score = ((df[buy_column] / buy_plus_sell) * 2) - 1.0  # in [-1, +1]
+    if last_rows:
+        values = np.full(len(df), np.nan)
+        values[rows] = out
+        out = values
 
-    df[trade_column_out] = buy_sell_score  # High values mean buy signal
-    #df[buy_column_out] = df[df[buy_column_out] < 0] = 0  # Set negative values to 0
+    df[out_column] = out
 
-    return buy_sell_score
+    return df, [out_column]
 
 
-def combine_scores_difference(df, buy_column, sell_column, trade_column_out):
+def combine_scores(up, down, combine: str = None):
     """
-    This transformation represents how much buy score higher than sell score.
-    If they are equal then the output is 0. The output scores have opposite signs.
+    Combine arrays of up and down scores into one score array:
+    - relative: proportion of the up score in the sum of both scores scaled to [-1, +1]
+    - difference: up score minus down score
+    - otherwise: up score if it is greater than (or equal to) down score and negative down score otherwise
     """
-
-    # difference
-    buy_minus_sell = df[buy_column] - df[sell_column]
-
-    df[trade_column_out] = buy_minus_sell  # High values mean buy signal
-    #df[buy_column_out] = df[df[buy_column_out] < 0] = 0  # Set negative values to 0
-
-    return buy_minus_sell
+    if combine == "relative":
+        return ((up / (up + down)) * 2) - 1.0
+    elif combine == "difference":
+        return up - down
+    else:
+        return np.where(up >= down, up, -down)  # Comparison with NaN is false as in the row-wise version
 
 
 def compute_score_slope(df, model, buy_score_columns_in, sell_score_columns_in):
@@ -486,6 +652,60 @@ def find_interval_precision(df: pd.DataFrame, label_column: str, score_column: s
     return interval_df
 
 
+def interval_precision_sweep(df: pd.DataFrame, label_column: str, pairs: list, intervals: tuple = None, below: bool = False):
+    """
+    Interval-wise precision and recall (as defined in find_interval_precision) for many (score column, threshold) pairs.
+
+    The contiguous intervals of the label column are found only once. They can be also passed as the result of find_intervals
+    computed for this label column so that they are reused by many sweeps (e.g., during hyper-parameter search).
+    For each score column, the maximum score within each interval is computed only once, and an interval is then positive
+    for a threshold if this maximum is not lower than the threshold. Thus all thresholds of one score column are evaluated
+    without re-aggregating the points. If below is true, then an interval is positive if its minimum score is not greater
+    than the threshold (like sell thresholds).
+
+    Return a data frame with one row per pair with the numbers of true/false positive/negative intervals, precision and recall.
+    """
+    if intervals is None:
+        intervals = find_intervals(df[label_column].to_numpy())
+    starts, interval_labels = intervals
+
+    records = []
+    for score_column in dict.fromkeys(column for column, _ in pairs):
+        thresholds = np.array([threshold for column, threshold in pairs if column == score_column], dtype=float)
+
+        # Rows are intervals and columns are thresholds
+        if below:
+            # Minimum (ignoring NaN) of the score within each interval
+            interval_min = np.fmin.reduceat(df[score_column].to_numpy(dtype=float), starts)
+            interval_scores = interval_min[:, None] <= thresholds[None, :]
+        else:
+            # Maximum (ignoring NaN) of the score within each interval
+            interval_max = np.fmax.reduceat(df[score_column].to_numpy(dtype=float), starts)
+            interval_scores = interval_max[:, None] >= thresholds[None, :]
+
+        tp = (interval_scores & interval_labels[:, None]).sum(axis=0)
+        fp = (interval_scores & ~interval_labels[:, None]).sum(axis=0)
+        fn = (~interval_scores & interval_labels[:, None]).sum(axis=0)
+        tn = (~interval_scores & ~interval_labels[:, None]).sum(axis=0)
+
+        for i, threshold in enumerate(thresholds):
+            records.append(dict(
+                score_column=score_column, threshold=threshold,
+                tp=int(tp[i]), fp=int(fp[i]), fn=int(fn[i]), tn=int(tn[i]),
+                precision=tp[i] / (tp[i] + fp[i]) if tp[i] + fp[i] else 0.0,
+                recall=tp[i] / (tp[i] + fn[i]) if tp[i] + fn[i] else 0.0,
+            ))
+
+    return pd.DataFrame(records)
+
+
+def find_intervals(labels: np.ndarray):
+    """Return the start positions and the (boolean) labels of the contiguous intervals with equal labels."""
+    labels = np.asarray(labels).astype(bool)
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(labels)) + 1]) if len(labels) else np.empty(0, dtype=np.int64)
+    return starts, labels[starts]
+
+
 def generate_score_high_low(df, feature_sets):
     """
     Add a score column which aggregates different types of scores generated by various algorithms with different options.
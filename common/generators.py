@@ -1,4 +1,8 @@
 from typing import Tuple
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import pandas as pd
@@ -73,9 +77,9 @@ def generate_feature_set(df: pd.DataFrame, fs: dict, last_rows: int) -> Tuple[pd
 
     # Signals
     elif generator == "smoothen":
-        f_df, features = generate_smoothen_scores(f_df, gen_config)
+        f_df, features = generate_smoothen_scores(f_df, gen_config, last_rows=last_rows)
     elif generator == "combine":
-        f_df, features = generate_combine_scores(f_df, gen_config)
+        f_df, features = generate_combine_scores(f_df, gen_config, last_rows=last_rows)
     elif generator == "threshold_rule":
         f_df, features = generate_threshold_rule(f_df, gen_config)
     elif generator == "threshold_rule2":
@@ -108,7 +112,12 @@ def generate_feature_set(df: pd.DataFrame, fs: dict, last_rows: int) -> Tuple[pd
     return df, new_features
 
 
-def predict_feature_set(df, fs, config, models: dict):
+def predict_feature_set(df, fs, config, models: dict, latencies: dict = None):
+    """
+    Apply all models of the train feature set to the data and return a data frame with their scores.
+    All models are applied together so that the common preprocessing steps are done only once.
+    If the latencies dict is provided, then the prediction time of each model is stored in it.
+    """
 
     labels = fs.get("config").get("labels")
     if not labels:
@@ -129,8 +138,8 @@ def predict_feature_set(df, fs, config, models: dict):
     train_df = df[train_features]
 
     features = []
-    scores = dict()
-    out_df = pd.DataFrame(index=train_df.index)  # Collect predictions
+    model_list = []  # Models to be applied
+    model_labels = []
 
     for label in labels:
         for model_config in algorithms:
@@ -138,30 +147,25 @@ def predict_feature_set(df, fs, config, models: dict):
             algo_name = model_config.get("name")
             algo_type = model_config.get("algo")
             score_column_name = label + label_algo_separator + algo_name
-            algo_train_length = model_config.get("train", {}).get("length")
 
             # It is an entry from loaded model dict
             model_pair = models.get(score_column_name)  # Trained model from model registry
 
             print(f"Predict '{score_column_name}'. Algorithm {algo_name}. Label: {label}. Train length {len(train_df)}. Train columns {len(train_df.columns)}")
 
-            if algo_type == "gb":
-                df_y_hat = predict_gb(model_pair, train_df, model_config)
-            elif algo_type == "nn":
-                df_y_hat = predict_nn(model_pair, train_df, model_config)
-            elif algo_type == "lc":
-                df_y_hat = predict_lc(model_pair, train_df, model_config)
-            elif algo_type == "svc":
-                df_y_hat = predict_svc(model_pair, train_df, model_config)
-            else:
-                raise ValueError(f"Unknown algorithm type '{algo_type}'")
-
-            out_df[score_column_name] = df_y_hat
+            model_list.append((score_column_name, algo_type, model_pair, model_config))
+            model_labels.append(label)
             features.append(score_column_name)
 
-            # For each new score, compare it with the label true values
-            if label in df:
-                scores[score_column_name] = compute_scores(df[label], df_y_hat)
+    y_hat = predict_fused(model_list, train_df.values, latencies)
+
+    out_df = pd.DataFrame(y_hat, index=train_df.index, columns=features)  # All predictions in one block
+
+    # For each new score, compare it with the label true values
+    scores = dict()
+    for i, (score_column_name, label) in enumerate(zip(features, model_labels)):
+        if label in df:
+            scores[score_column_name] = compute_scores(df[label], y_hat[:, i])
 
     return out_df, features, scores
 
@@ -184,54 +188,143 @@ def train_feature_set(df, fs, config):
     if not train_features:
         train_features = config.get("train_features")
 
+    unknown_types = [x.get("algo") for x in algorithms if x.get("algo") not in algorithm_types]
+    if unknown_types:
+        print(f"ERROR: Unknown algorithm types {unknown_types}. Check algorithm list.")
+        return
+
     models = dict()
     scores = dict()
-    out_df = pd.DataFrame()  # Collect predictions
+    predictions = dict()  # Collect predictions
 
-    for label in labels:
-        for model_config in algorithms:
+    parallel_config = config.get("train_parallel") or {}
+    if parallel_config.get("max_workers", 1) > 1:
+        jobs = []
+        for label in labels:
+            for model_config in algorithms:
+                score_column_name = label + label_algo_separator + model_config.get("name")
+                jobs.append((score_column_name, label, model_config))
 
-            algo_name = model_config.get("name")
-            algo_type = model_config.get("algo")
-            score_column_name = label + label_algo_separator + algo_name
+        results = train_jobs_parallel(df, train_features, jobs, parallel_config)
+
+        for (score_column_name, label, model_config), (model_pair, y_hat) in zip(jobs, results):
             algo_train_length = model_config.get("train", {}).get("length")
+            train_df = df.tail(algo_train_length) if algo_train_length else df
 
-            # Limit length according to the algorith parameters
-            if algo_train_length:
-                train_df = df.tail(algo_train_length)
-            else:
-                train_df = df
-            df_X = train_df[train_features]
-            df_y = train_df[label]
+            models[score_column_name] = model_pair
+            scores[score_column_name] = compute_scores(train_df[label], y_hat)
+            predictions[score_column_name] = pd.Series(y_hat, index=train_df.index)
 
-            print(f"Train '{score_column_name}'. Algorithm {algo_name}. Label: {label}. Train length {len(df_X)}. Train columns {len(df_X.columns)}")
+        return pd.DataFrame(predictions), models, scores
+
+    try:
+        for label in labels:
+            for model_config in algorithms:
+
+                algo_name = model_config.get("name")
+                algo_type = model_config.get("algo")
+                score_column_name = label + label_algo_separator + algo_name
+                algo_train_length = model_config.get("train", {}).get("length")
+
+                # Limit length according to the algorith parameters
+                if algo_train_length:
+                    train_df = df.tail(algo_train_length)
+                else:
+                    train_df = df
+                df_X = train_df[train_features]
+                df_y = train_df[label]
+
+                print(f"Train '{score_column_name}'. Algorithm {algo_name}. Label: {label}. Train length {len(df_X)}. Train columns {len(df_X.columns)}")
+
+                model_pair = train_model(algo_type, df_X, df_y, model_config)
 
-            if algo_type == "gb":
-                model_pair = train_gb(df_X, df_y, model_config)
-                models[score_column_name] = model_pair
-                df_y_hat = predict_gb(model_pair, df_X, model_config)
-            elif algo_type == "nn":
-                model_pair = train_nn(df_X, df_y, model_config)
-                models[score_column_name] = model_pair
-                df_y_hat = predict_nn(model_pair, df_X, model_config)
-            elif algo_type == "lc":
-                model_pair = train_lc(df_X, df_y, model_config)
-                models[score_column_name] = model_pair
-                df_y_hat = predict_lc(model_pair, df_X, model_config)
-            elif algo_type == "svc":
-                model_pair = train_svc(df_X, df_y, model_config)
                 models[score_column_name] = model_pair
-                df_y_hat = predict_svc(model_pair, df_X, model_config)
-            else:
-                print(f"ERROR: Unknown algorithm type {algo_type}. Check algorithm list.")
-                return
+                y_hat = predict_array(algo_type, model_pair, df_X, model_config)
+
+                scores[score_column_name] = compute_scores(df_y, y_hat)
+                predictions[score_column_name] = pd.Series(y_hat, index=df_X.index)  # Algorithms may use different train lengths
 
-            scores[score_column_name] = compute_scores(df_y, df_y_hat)
-            out_df[score_column_name] = df_y_hat
+        out_df = pd.DataFrame(predictions)  # Assemble all predictions in one frame
+    finally:
+        # Free the cached data sets and scaled matrices also if training fails
+        clear_gb_dataset_cache()
+        clear_scaler_cache()
 
     return out_df, models, scores
 
 
+#
+# Parallel training
+#
+
+def train_jobs_parallel(df, train_features: list, jobs: list, parallel_config: dict) -> list:
+    """
+    Train the models of all jobs (score column name, label, algorithm) in worker processes and return (model pair, train predictions) for each job.
+    The feature matrix is stored in shared memory so that it is not copied to each job.
+    Each job gets a budget of threads_per_worker threads so that the workers do not oversubscribe the cores.
+    """
+    max_workers = min(parallel_config.get("max_workers"), len(jobs))
+    threads_per_worker = parallel_config.get("threads_per_worker") or max(1, (os.cpu_count() or 1) // max_workers)
+
+    X = np.ascontiguousarray(df[train_features].values, dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+    try:
+        np.ndarray(X.shape, dtype=X.dtype, buffer=shm.buf)[:] = X
+        X_spec = (shm.name, X.shape, X.dtype.str, list(train_features))
+
+        print(f"Train {len(jobs)} models in {max_workers} processes with {threads_per_worker} threads each.")
+
+        # Spawned workers do not inherit the (possibly big) state of this process like imported TF or thread pools
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=_init_train_worker, initargs=(threads_per_worker,)) as executor:
+            futures = []
+            for score_column_name, label, model_config in jobs:
+                model_config = dict(model_config, train=dict(model_config.get("train", {}), num_threads=threads_per_worker))
+                algo_train_length = model_config.get("train", {}).get("length")
+                df_y = df[label].tail(algo_train_length) if algo_train_length else df[label]
+                futures.append(executor.submit(_train_shared_job, X_spec, df_y.values, model_config, threads_per_worker))
+
+            results = []
+            for (score_column_name, label, model_config), future in zip(jobs, futures):
+                results.append(future.result())
+                print(f"Trained '{score_column_name}'.")
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return results
+
+
+def _init_train_worker(num_threads: int):
+    # Libraries imported later in the worker (lightgbm, tensorflow) read these variables
+    for var in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"]:
+        os.environ[var] = str(num_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+
+def _train_shared_job(X_spec: tuple, y: np.ndarray, model_config: dict, num_threads: int):
+    """Train one model on the last len(y) rows of the feature matrix in shared memory and return the model pair with its train predictions."""
+    from threadpoolctl import threadpool_limits
+
+    shm_name, shape, dtype, columns = X_spec
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        X = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        df_X = pd.DataFrame(X[len(X) - len(y):], columns=columns, copy=False)
+        df_y = pd.Series(y, index=df_X.index)
+
+        algo_type = model_config.get("algo")
+        with threadpool_limits(limits=num_threads):
+            model_pair = train_model(algo_type, df_X, df_y, model_config)
+            y_hat = predict_array(algo_type, model_pair, df_X, model_config)
+
+        del df_X, X  # Views of the shared buffer have to be released before closing it
+    finally:
+        shm.close()
+
+    return model_pair, y_hat
+
+
 def resolve_generator_name(gen_name: str):
     """
     Resolve the specified name to a function reference.
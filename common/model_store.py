@@ -1,9 +1,16 @@
 import itertools
+import hashlib
+import os
+import pickle
 from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 from joblib import dump, load
 
-from keras.models import Sequential, save_model, load_model
+from common.classifiers import lazy_import
 
 label_algo_separator = "_"
 
@@ -42,7 +49,7 @@ def save_model_pair(model_path, score_column_name: str, model_pair: tuple):
     if score_column_name.endswith("_nn"):
         model_extension = ".h5"
         model_file_name = (model_path / score_column_name).with_suffix(model_extension)
-        save_model(model, model_file_name)
+        lazy_import("keras.models").save_model(model, model_file_name)
     else:
         model_extension = ".pickle"
         model_file_name = (model_path / score_column_name).with_suffix(model_extension)
@@ -61,7 +68,7 @@ def load_model_pair(model_path, score_column_name: str):
     if score_column_name.endswith("_nn"):
         model_extension = ".h5"
         model_file_name = (model_path / score_column_name).with_suffix(model_extension)
-        model = load_model(model_file_name)
+        model = lazy_import("keras.models").load_model(model_file_name)
     else:
         model_extension = ".pickle"
         model_file_name = (model_path / score_column_name).with_suffix(model_extension)
@@ -70,16 +77,183 @@ def load_model_pair(model_path, score_column_name: str):
     return (model, scaler)
 
 
-def load_models(model_path, labels: list, algorithms: list):
-    """Load all model pairs for all combinations of labels and algorithms and return as a dict."""
+def load_models(model_path, labels: list, algorithms: list, bundle_file_name: str = None):
+    """
+    Load all model pairs for all combinations of labels and algorithms and return as a dict.
+    If the bundle file is specified, exists, contains all models and was created from the current model files, then load the models from it.
+    """
+    score_column_names = [
+        label_algorithm[0] + label_algo_separator + label_algorithm[1]["name"]
+        for label_algorithm in itertools.product(labels, algorithms)
+    ]
+
+    if bundle_file_name:
+        bundle_models = load_model_bundle_if_valid(model_path, bundle_file_name, score_column_names)
+        if bundle_models is not None:
+            return bundle_models
+
     models = {}
-    for label_algorithm in itertools.product(labels, algorithms):
-        score_column_name = label_algorithm[0] + label_algo_separator + label_algorithm[1]["name"]
+    for score_column_name in score_column_names:
         model_pair = load_model_pair(model_path, score_column_name)
         models[score_column_name] = model_pair
     return models
 
 
+#
+# Model bundle
+#
+
+"""
+A bundle stores all model pairs in one file (joblib format) which consists of a manifest and payloads.
+Each model and scaler is pickled (protocol 5) with its numpy arrays (coefficients, support vectors, scaler statistics etc.)
+stored out-of-band as separate arrays of the bundle. These arrays are memory-mapped (copy-on-write) and used
+by the restored models without copying. Only the small remaining pickle data is parsed (in parallel).
+LightGBM models have no such arrays: their model text is stored in the pickle data and parsed on loading.
+NN models are stored as (JSON) architecture and weight arrays which are copied to the model variables.
+The manifest stores the hashes of the individual model files so that a bundle which is not up-to-date is not used.
+"""
+
+bundle_format_version = 3
+
+model_file_extensions = [".scaler", ".pickle", ".h5"]
+
+
+def save_model_bundle(model_path, bundle_file_name: str, models: dict):
+    """Save all model pairs in one bundle file. The file is written to a temporary file which is then renamed."""
+    if not isinstance(model_path, Path):
+        model_path = Path(model_path)
+    bundle_file = (model_path / bundle_file_name).absolute()
+
+    manifest = dict(version=bundle_format_version, created=datetime.now().isoformat(), entries={})
+    payloads = {}
+    for score_column_name, (model, scaler) in models.items():
+        is_nn = score_column_name.endswith("_nn")
+        manifest["entries"][score_column_name] = dict(
+            format="nn" if is_nn else "pickle",
+            model_type=type(model).__name__,
+            scaler_type=type(scaler).__name__,
+            files=_model_file_hashes(model_path, score_column_name),
+        )
+        if is_nn:
+            model_payload = dict(config=model.to_json(), weights=model.get_weights())
+        else:
+            model_payload = _to_payload(model)
+        payloads[score_column_name] = dict(model=model_payload, scaler=_to_payload(scaler))
+
+    temp_file = bundle_file.with_name(bundle_file.name + ".tmp")
+    dump(dict(manifest=manifest, payloads=payloads), temp_file)
+    os.replace(temp_file, bundle_file)
+
+    return bundle_file
+
+
+def load_model_bundle(model_path, bundle_file_name: str, score_column_names: list = None, max_workers: int = None):
+    """
+    Load model pairs from the bundle file and return them as a dict. If the list of score columns is specified then only these models are loaded.
+    The file is memory-mapped so only the payloads of the requested models are read.
+    """
+    if not isinstance(model_path, Path):
+        model_path = Path(model_path)
+    bundle_file = (model_path / bundle_file_name).absolute()
+
+    bundle = load(bundle_file, mmap_mode="c")
+
+    return _models_from_bundle(bundle, bundle_file, score_column_names, max_workers)
+
+
+def load_model_bundle_if_valid(model_path, bundle_file_name: str, score_column_names: list):
+    """
+    Load models from the bundle if it exists and was created from the current model files. Otherwise, return None.
+    Model files which are different from those stored in the bundle (e.g., copied manually) have priority.
+    The contents are compared (and not the modification times) because copying might preserve the modification times.
+    Model files which do not exist are ignored (the bundle can be used without them).
+    """
+    if not isinstance(model_path, Path):
+        model_path = Path(model_path)
+    bundle_file = (model_path / bundle_file_name).absolute()
+    if not bundle_file.is_file():
+        return None
+
+    try:
+        bundle = load(bundle_file, mmap_mode="c")
+        manifest = bundle["manifest"]
+        entries = manifest["entries"] if manifest.get("version") == bundle_format_version else {}
+        for score_column_name in score_column_names:
+            stored_hashes = entries.get(score_column_name, {}).get("files", {})
+            for file_name, file_hash in _model_file_hashes(model_path, score_column_name).items():
+                if stored_hashes.get(file_name) != file_hash:
+                    print(f"Model bundle {bundle_file} is not up-to-date (model file {file_name} is different). Model files will be used.")
+                    return None
+
+        return _models_from_bundle(bundle, bundle_file, score_column_names)
+    except Exception as e:
+        print(f"Cannot load models from the bundle {bundle_file}. Model files will be used. {e}")
+        return None
+
+
+def _models_from_bundle(bundle: dict, bundle_file: Path, score_column_names: list = None, max_workers: int = None):
+    """Restore the models from the loaded (memory-mapped) bundle. Models except for NN are restored in parallel."""
+    manifest = bundle["manifest"]
+    if manifest.get("version") != bundle_format_version:
+        raise ValueError(f"Unknown model bundle version {manifest.get('version')} in file {bundle_file}.")
+
+    if score_column_names is None:
+        score_column_names = list(manifest["entries"].keys())
+    missing = [name for name in score_column_names if name not in manifest["entries"]]
+    if missing:
+        raise ValueError(f"Models {missing} not found in the model bundle {bundle_file}.")
+
+    def restore(score_column_name):
+        entry = manifest["entries"][score_column_name]
+        payload = bundle["payloads"][score_column_name]
+        if entry["format"] == "nn":
+            model = _nn_from_payload(payload["model"])
+        else:
+            model = _from_payload(payload["model"])
+        scaler = _from_payload(payload["scaler"])
+        return score_column_name, (model, scaler)
+
+    nn_names = [name for name in score_column_names if manifest["entries"][name]["format"] == "nn"]
+    other_names = [name for name in score_column_names if name not in nn_names]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        models = dict(executor.map(restore, other_names))
+
+    # NN models are built in this thread (keras models are not created in worker threads)
+    models.update(map(restore, nn_names))
+
+    return {name: models[name] for name in score_column_names}
+
+
+def _model_file_hashes(model_path: Path, score_column_name: str) -> dict:
+    """Hashes of the existing model files (scaler and model) of one model pair."""
+    hashes = {}
+    for extension in model_file_extensions:
+        model_file = (model_path / score_column_name).with_suffix(extension)
+        if model_file.is_file():
+            hashes[model_file.name] = hashlib.blake2b(model_file.read_bytes()).hexdigest()
+    return hashes
+
+
+def _to_payload(obj):
+    """Pickle the object. Its (contiguous) numpy arrays are not copied into the pickle data but returned as separate buffer arrays."""
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    return dict(data=np.frombuffer(data, dtype=np.uint8), buffers=[np.frombuffer(b.raw(), dtype=np.uint8) for b in buffers])
+
+
+def _from_payload(payload: dict):
+    """Unpickle the object. Its numpy arrays are views of the (memory-mapped) buffer arrays."""
+    return pickle.loads(memoryview(payload["data"]), buffers=payload["buffers"])
+
+
+def _nn_from_payload(payload: dict):
+    keras = lazy_import("keras")
+    model = keras.models.model_from_json(payload["config"])
+    model.set_weights([np.asarray(w) for w in payload["weights"]])
+    return model
+
+
 def score_to_label_algo_pair(score_column_name: str):
     """
     Parse a score column name and return its two constituents: label column name and algorithm name.
@@ -157,6 +331,14 @@ models = [
         "train": {"is_scale": True, "length": None, "shifts": []},
         "predict": {"length": 1440}
     },
+    {
+        "name": "svc-nystroem",
+        "algo": "svc",
+        # Kernel approximation ("nystroem" or "rff") followed by a linear classifier. Linear cost in the train length
+        "params": {"approximation": "nystroem", "n_components": 500, "kernel": "rbf", "gamma": "scale", "C": 1.0},
+        "train": {"is_scale": True, "length": int(1.0 * 525_600), "shifts": []},
+        "predict": {"length": 1440}
+    },
 
     {
         "name": "nn_long",
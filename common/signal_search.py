@@ -0,0 +1,136 @@
+import itertools
+
+import numpy as np
+
+"""
+Adaptive search for the best parameters of signal generators as an alternative to the exhaustive grid search.
+The search space is the same grid (a list of values for each parameter) but only a small part of its points is evaluated:
+- refine: coarse-to-fine search which evaluates a coarse sub-grid and then zooms into the neighborhoods of the best points
+- bayes: Bayesian-style sequential sampling which proposes new points where good points are more likely than bad points (TPE)
+Points are represented by value indexes so that the search works for any (sorted) lists of values.
+"""
+
+
+def search_parameters(parameter_grid: dict, evaluate_fn, objective_fn, search_config: dict):
+    """
+    Find the best parameters in the grid by evaluating only some of its points.
+
+    :param parameter_grid: dict with a list of values for each parameter (same as for ParameterGrid)
+    :param evaluate_fn: function which gets a list of parameter dicts and returns a list of results (one per parameter dict)
+    :param objective_fn: function which returns a number for a result (higher is better)
+    :param search_config: method ("grid", "refine" or "bayes") and its options
+    :return: list of results of all evaluated points
+    """
+    names = sorted(parameter_grid.keys())  # The same order as in ParameterGrid
+    values = [list(parameter_grid[name]) for name in names]
+    sizes = np.array([len(v) for v in values])
+
+    evaluated = {}  # Key is a tuple of value indexes and value is (objective, result)
+
+    def evaluate(points):
+        points = [p for p in dict.fromkeys(points) if p not in evaluated]  # Unique new points in the original order
+        if not points:
+            return 0
+        parameter_list = [{name: values[d][i] for d, (name, i) in enumerate(zip(names, p))} for p in points]
+        results = evaluate_fn(parameter_list)
+        for p, result in zip(points, results):
+            evaluated[p] = (objective_fn(result), result)
+        return len(points)
+
+    method = search_config.get("method", "grid")
+    if method == "grid":
+        evaluate(list(itertools.product(*[range(size) for size in sizes])))
+    elif method == "refine":
+        _refine_search(sizes, evaluate, evaluated, search_config)
+    elif method == "bayes":
+        _bayes_search(sizes, evaluate, evaluated, search_config)
+    else:
+        raise ValueError(f"Unknown search method '{method}'. Use 'grid', 'refine' or 'bayes'.")
+
+    total = int(np.prod(sizes))
+    print(f"Search '{method}' evaluated {len(evaluated)} of {total} parameter sets. Evaluations saved: {total - len(evaluated)} ({100.0 * (total - len(evaluated)) / total:.1f}%).")
+
+    return [result for objective, result in evaluated.values()]
+
+
+def _best_points(evaluated: dict, k: int):
+    return sorted(evaluated.keys(), key=lambda p: evaluated[p][0], reverse=True)[:k]
+
+
+def _refine_search(sizes, evaluate, evaluated, search_config: dict):
+    """
+    Coarse-to-fine search. First, every step-th value of each parameter is evaluated (coarse grid with coarse_points values per parameter).
+    Then all neighbors (at the distance of the step) of the top_k best points are evaluated until the best points do not change
+    anymore. After that, the step is halved and the procedure is repeated until the step is 1.
+    """
+    coarse_points = search_config.get("coarse_points", 5)
+    top_k = search_config.get("top_k", 5)
+
+    steps = np.maximum(1, (sizes - 1) // max(coarse_points - 1, 1))
+    coarse_axes = [sorted(set(range(0, size, step)) | {size - 1}) for size, step in zip(sizes, steps)]
+    evaluate(list(itertools.product(*coarse_axes)))
+
+    while True:
+        new_points = 1
+        while new_points:
+            new_points = 0
+            for point in _best_points(evaluated, top_k):
+                axes = [
+                    sorted({min(max(i + delta, 0), size - 1) for delta in (-step, 0, step)})
+                    for i, size, step in zip(point, sizes, steps)
+                ]
+                new_points += evaluate(list(itertools.product(*axes)))
+        if np.all(steps == 1):
+            break
+        steps = np.maximum(1, steps // 2)
+
+
+def _bayes_search(sizes, evaluate, evaluated, search_config: dict):
+    """
+    Sequential model-based search similar to the tree-structured Parzen estimator (TPE).
+    After n_initial random points, each iteration splits the evaluated points into good (the best gamma fraction) and bad ones,
+    samples candidates around the good points and evaluates batch_size candidates with the highest ratio of good to bad density.
+    """
+    n_initial = search_config.get("n_initial", 20)
+    n_iterations = search_config.get("n_iterations", 10)
+    batch_size = search_config.get("batch_size", 10)
+    gamma = search_config.get("gamma", 0.25)
+    n_candidates = search_config.get("n_candidates", 50 * batch_size)
+    rng = np.random.default_rng(search_config.get("seed", 0))
+
+    total = int(np.prod(sizes))
+    scale = np.maximum(sizes - 1, 1)  # Points are compared in the normalized space [0, 1]
+
+    initial = [tuple(int(i) for i in rng.integers(0, sizes)) for _ in range(min(n_initial, total))]
+    evaluate(initial)
+
+    for iteration in range(n_iterations):
+        if len(evaluated) >= total:
+            break
+
+        points = _best_points(evaluated, len(evaluated))
+        n_good = max(1, int(gamma * len(points)))
+        good = np.array(points[:n_good]) / scale
+        bad = np.array(points[n_good:]) / scale if len(points) > n_good else np.empty((0, len(sizes)))
+
+        # The neighborhoods shrink with iterations
+        bandwidth = max(0.5 * (1.0 - iteration / n_iterations), 0.05)
+
+        centers = good[rng.integers(0, len(good), n_candidates)]
+        candidates = np.clip(np.rint((centers + rng.normal(0.0, bandwidth, centers.shape)) * scale), 0, sizes - 1).astype(int)
+        candidates = [c for c in dict.fromkeys(map(tuple, candidates.tolist())) if c not in evaluated]
+        if not candidates:
+            continue
+
+        x = np.array(candidates) / scale
+        score = np.log(_density(x, good, bandwidth) + 1e-12) - np.log(_density(x, bad, bandwidth) + 1e-12)
+        best = np.argsort(-score, kind="stable")[:batch_size]
+        evaluate([candidates[i] for i in best])
+
+
+def _density(x, points, bandwidth):
+    """Gaussian kernel density of the points at x."""
+    if len(points) == 0:
+        return np.ones(len(x))
+    d2 = ((x[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+    return np.exp(-0.5 * d2 / bandwidth ** 2).mean(axis=1)
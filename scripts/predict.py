@@ -8,6 +8,7 @@ import pandas as pd
 
 from service.App import *
 from common.model_store import *
+from common.classifiers import print_import_times
 from common.generators import predict_feature_set
 
 """
@@ -93,7 +94,7 @@ def main(config_file):
         model_path = data_path / model_path
     model_path = model_path.resolve()
 
-    models = load_models(model_path, labels, algorithms)
+    models = load_models(model_path, labels, algorithms, App.config.get("model_bundle_file_name"))
 
     #
     # Generate/predict train features
@@ -164,6 +165,7 @@ def main(config_file):
     #
     elapsed = datetime.now() - now
     print(f"Finished training models in {str(elapsed).split('.')[0]}")
+    print_import_times()
 
 
 if __name__ == '__main__':
@@ -1,4 +1,6 @@
 from pathlib import Path
+import hashlib
+import json
 from datetime import datetime, timezone, timedelta
 from concurrent.futures import ProcessPoolExecutor
 import click
@@ -141,8 +143,22 @@ def main(config_file):
     #in_df = in_df.dropna(subset=labels)
     df = df.reset_index(drop=True)  # We must reset index after removing rows to remove gaps
 
-    # Result rows. Here store only rows for which we make predictions
-    labels_hat_df = pd.DataFrame()
+    # Result rows. Here store only rows for which we make predictions (one data frame per step)
+    step_dfs = []
+
+    # Each finished step is stored in its own partition file so that an interrupted run can be resumed
+    checkpoint_path = rp_config.get("checkpoint_folder")
+    if checkpoint_path:
+        checkpoint_path = Path(checkpoint_path)
+        if not checkpoint_path.is_absolute():
+            checkpoint_path = data_path / checkpoint_path
+        checkpoint_path = checkpoint_path.resolve()
+        checkpoint_path.mkdir(parents=True, exist_ok=True)  # Ensure that folder exists
+
+    score_column_names = [label + label_algo_separator + model_config.get("name") for label in labels for model_config in algorithms]
+
+    # Parameters which determine the predictions. Partitions computed with other parameters are not reused
+    fingerprint_config = {k: App.config.get(k) for k in ["train_features", "labels", "label_horizon", "train_length", "algorithms"]}
 
     print(f"Start index: {prediction_start}. Number of steps: {prediction_steps}. Step size: {prediction_size}")
     print(f"Starting rolling predict loop...")
@@ -178,6 +194,16 @@ def main(config_file):
         train_df = df.iloc[train_start:train_end]  # We assume that iloc is equal to index
         train_df = train_df.dropna(subset=train_features)
 
+        # Skip the step if its predictions have been already stored by a previous (interrupted) run with the same parameters and data
+        if checkpoint_path:
+            partition_file = checkpoint_path / f"step-{predict_start}-{predict_end}.pickle"
+            fingerprint = step_fingerprint(fingerprint_config, train_df, predict_df)
+            stored_df = load_step_partition(partition_file, score_column_names, fingerprint)
+            if stored_df is not None:
+                step_dfs.append(stored_df)
+                print(f"\n===>>> Skip step {step}/{prediction_steps}. Predictions loaded from partition file {partition_file.name}")
+                continue
+
         print(f"\n===>>> Start step {step}/{prediction_steps}. Train range: [{train_start}, {train_end}]={train_end-train_start}. Prediction range: [{predict_start}, {predict_end}]={predict_end-predict_start}. Jobs/scores: {len(labels)*len(algorithms)}. {use_multiprocessing=} ")
 
         step_start_time = datetime.now()
@@ -257,13 +283,27 @@ def main(config_file):
         #
 
         # Predictions for all labels and histories (and algorithms) have been generated for the iteration
-        labels_hat_df = pd.concat([labels_hat_df, predict_labels_df])
+        step_dfs.append(predict_labels_df)
+
+        # Persist the step so that it is not lost if the run is interrupted
+        if checkpoint_path:
+            predict_labels_df.attrs["fingerprint"] = fingerprint  # Stored in the pickle file together with the data frame
+            tmp_file = partition_file.with_suffix(".tmp")
+            predict_labels_df.to_pickle(tmp_file)
+            tmp_file.replace(partition_file)  # Rename only a completely written file
+
+        # Free the scaled matrices of this step. The binned gb data sets are kept only if their bins are reused by the next step
+        clear_scaler_cache()
+        if not any(model_config.get("train", {}).get("reuse_bins") for model_config in algorithms):
+            clear_gb_dataset_cache()
 
         elapsed = datetime.now() - step_start_time
         print(f"End step {step}/{prediction_steps}. Scores predicted: {len(predict_labels_df.columns)}. Time elapsed: {str(elapsed).split('.')[0]}")
 
 
     # End of loop over prediction steps
+    labels_hat_df = pd.concat(step_dfs) if step_dfs else pd.DataFrame()  # Single concatenation of all step partitions
+
     print("")
     print(f"Finished all {prediction_steps} prediction steps each with {prediction_size} predicted rows (stride). ")
     print(f"Size of predicted dataframe {len(labels_hat_df)}. Number of rows in all steps {prediction_steps*prediction_size} (steps * stride). ")
@@ -318,6 +358,42 @@ def main(config_file):
 
     elapsed = datetime.now() - now
     print(f"Finished rolling prediction in {str(elapsed).split('.')[0]}")
+    print_import_times()
+
+
+def step_fingerprint(config: dict, train_df: pd.DataFrame, predict_df: pd.DataFrame) -> str:
+    """Hash of the parameters and of the train and predict rows (index and values) of one rolling step."""
+    h = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode())
+    for df in (train_df, predict_df):
+        h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+        h.update(json.dumps(df.columns.to_list()).encode())
+    return h.hexdigest()
+
+
+def load_step_partition(partition_file: Path, score_column_names: list, fingerprint: str):
+    """
+    Load predictions of one rolling step stored by a previous run.
+    Return None if the partition does not exist or cannot be used (e.g., broken file, different score columns or
+    the step was computed with other parameters or input data).
+    """
+    if not partition_file.is_file():
+        return None
+
+    try:
+        df = pd.read_pickle(partition_file)
+    except Exception as e:
+        print(f"WARNING: Cannot read partition file {partition_file}. The step will be recomputed. Exception: {e}")
+        return None
+
+    if df.columns.to_list() != score_column_names:
+        print(f"WARNING: Partition file {partition_file} has different score columns. The step will be recomputed.")
+        return None
+
+    if df.attrs.get("fingerprint") != fingerprint:
+        print(f"WARNING: Partition file {partition_file} was computed with other parameters or input data. The step will be recomputed.")
+        return None
+
+    return df
 
 
 if __name__ == '__main__':
@@ -120,7 +120,11 @@ def main(config_file):
         fs_now = datetime.now()
         print(f"Start train feature set {i}/{len(train_feature_sets)}. Generator {fs.get('generator')}...")
 
-        fs_out_df, fs_models, fs_scores = train_feature_set(df, fs, App.config)
+        result = train_feature_set(df, fs, App.config)
+        if result is None:
+            print(f"ERROR: Models of the feature set {i} cannot be trained. Training stopped.")
+            return
+        fs_out_df, fs_models, fs_scores = result
 
         out_df = pd.concat([out_df, fs_out_df], axis=1)
         models.update(fs_models)
@@ -144,6 +148,11 @@ def main(config_file):
     for score_column_name, model_pair in models.items():
         save_model_pair(model_path, score_column_name, model_pair)
 
+    bundle_file_name = App.config.get("model_bundle_file_name")
+    if bundle_file_name:
+        bundle_file = save_model_bundle(model_path, bundle_file_name, models)
+        print(f"Model bundle stored in file: {bundle_file}")
+
     print(f"Models stored in path: {model_path.absolute()}")
 
     #
@@ -186,6 +195,7 @@ def main(config_file):
     #
     elapsed = datetime.now() - now
     print(f"Finished training models in {str(elapsed).split('.')[0]}")
+    print_import_times()
 
 
 if __name__ == '__main__':
@@ -1,4 +1,7 @@
+import os
 from pathlib import Path
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import click
 from tqdm import tqdm
 
@@ -6,11 +9,12 @@ import numpy as np
 import pandas as pd
 
 from sklearn.metrics import (precision_recall_curve, PrecisionRecallDisplay, RocCurveDisplay)
-from sklearn.model_selection import ParameterGrid
 
 from service.App import *
 from common.utils import *
 from common.gen_signals import *
+from common.backtesting import *
+from common.signal_search import search_parameters
 from common.classifiers import *
 from common.generators import generate_feature_set
 
@@ -89,8 +93,6 @@ def main(config_file):
 
     print(f"Input data size {len(df)} records. Range: [{df.iloc[0][time_column]}, {df.iloc[-1][time_column]}]")
 
-    months_in_simulation = (df[time_column].iloc[-1] - df[time_column].iloc[0]) / timedelta(days=365/12)
-
     #
     # Load signal train parameters
     #
@@ -123,68 +125,20 @@ def main(config_file):
     if not signal_generator:
         raise ValueError(f"Signal generator '{generator_name}' not found among all 'signal_sets'")
 
-    performances = list()
-    for parameters in tqdm(ParameterGrid([parameter_grid]), desc="MODELS"):
-
-        #
-        # If equal parameters, then derive the sell parameter from the buy parameter
-        #
-        if train_signal_config.get("buy_sell_equal"):
-            parameters["sell_signal_threshold"] = -parameters["buy_signal_threshold"]
-            #signal_model["sell_slope_threshold"] = -signal_model["buy_slope_threshold"]
-            if parameters.get("buy_signal_threshold_2") is not None:
-                parameters["sell_signal_threshold_2"] = -parameters["buy_signal_threshold_2"]
-
-        #
-        # Set new parameters of the signal generator
-        #
-        signal_generator["config"]["parameters"].update(parameters)
-
-        #
-        # Execute the signal generator with new parameters by producing new signal columns
-        #
-        df, new_features = generate_feature_set(df, signal_generator, last_rows=0)
-
-        #
-        # Simulate trade and compute performance using close price and two boolean signals
-        # Add a pair of two dicts: performance dict and model parameters dict
-        #
-
-        # These boolean columns are used for performance measurement. Alternatively, they are in trade_signal_model
-        buy_signal_column = signal_generator["config"]["names"][0]
-        sell_signal_column = signal_generator["config"]["names"][1]
-
-        # Perform backtesting
-        performance, long_performance, short_performance = simulated_trade_performance(
-            df,
-            buy_signal_column, sell_signal_column,
-            'close'
-        )
-
-        # Remove some items. Remove lists of transactions which are not needed
-        long_performance.pop('transactions', None)
-        short_performance.pop('transactions', None)
-
-        if direction == "long":
-            performance = long_performance
-        elif direction == "short":
-            performance = short_performance
-
-        # Add some metrics. Add per month metrics
-        performance["profit_percent_per_month"] = performance["profit_percent"] / months_in_simulation
-        performance["transaction_no_per_month"] = performance["transaction_no"] / months_in_simulation
-        performance["profit_percent_per_transaction"] = performance["profit_percent"] / performance["transaction_no"] if performance["transaction_no"] else 0.0
-        performance["profit_per_month"] = performance["profit"] / months_in_simulation
+    #
+    # Walk-forward mode: optimize on rolling train folds and evaluate the best parameters on the following test folds
+    #
+    walk_forward_config = train_signal_config.get("walk_forward")
+    if walk_forward_config:
+        walk_forward(df, parameter_grid, signal_generator, train_signal_config, walk_forward_config, out_path, time_column)
 
-        #long_performance["profit_percent_per_month"] = long_performance["profit_percent"] / months_in_simulation
-        #short_performance["profit_percent_per_month"] = short_performance["profit_percent"] / months_in_simulation
+        elapsed = datetime.now() - now
+        print(f"Finished walk-forward simulation in {str(elapsed).split('.')[0]}")
+        print_import_times()
+        return
 
-        performances.append(dict(
-            model=parameters,
-            performance={k: performance[k] for k in ['profit_percent_per_month', 'profitable', 'profit_percent_per_transaction', 'transaction_no_per_month']},
-            #long_performance={k: long_performance[k] for k in ['profit_percent_per_month', 'profitable']},
-            #short_performance={k: short_performance[k] for k in ['profit_percent_per_month', 'profitable']}
-        ))
+    # Exhaustive grid search (default) or adaptive search which evaluates only some points of the grid
+    performances = optimize_parameters(df, parameter_grid, signal_generator, train_signal_config, time_column)
 
     #
     # Flatten
@@ -229,6 +183,233 @@ def main(config_file):
 
     elapsed = datetime.now() - now
     print(f"Finished simulation in {str(elapsed).split('.')[0]}")
+    print_import_times()
+
+
+def optimize_parameters(df, parameter_grid: dict, signal_generator: dict, train_signal_config: dict, time_column: str) -> list:
+    """
+    Search the parameter grid using the data and return the performance records of all evaluated parameter sets.
+    The intervals of the interval labels (if any) are found once and reused for all evaluated parameter sets.
+    """
+    intervals = find_label_intervals(df, train_signal_config)
+    return search_parameters(
+        parameter_grid,
+        lambda parameter_list: evaluate_parameters(df, parameter_list, signal_generator, train_signal_config, time_column, intervals),
+        lambda x: x['performance']['profit_percent_per_month'],
+        train_signal_config.get("search", {})
+    )
+
+
+def evaluate_parameters(df, parameter_list: list, signal_generator: dict, train_signal_config: dict, time_column: str, intervals: dict = None) -> list:
+    """
+    Simulate trades for each parameter dict and return a list of performance records.
+    If interval labels are configured, then also the interval-wise precision and recall of the thresholds are computed
+    using the (precomputed) intervals of the label columns.
+    """
+    generator_name = signal_generator.get("generator")
+    direction = train_signal_config.get("direction", "")
+    interval_labels = train_signal_config.get("interval_labels") or {}
+    if interval_labels and generator_name not in ["threshold_rule", "threshold_rule2"]:
+        raise ValueError(f"Interval labels can be used only with threshold rules and not with '{generator_name}' signal generator.")
+
+    months_in_simulation = (df[time_column].iloc[-1] - df[time_column].iloc[0]) / timedelta(days=365/12)
+
+    #
+    # If equal parameters, then derive the sell parameter from the buy parameter
+    #
+    if train_signal_config.get("buy_sell_equal"):
+        for parameters in parameter_list:
+            parameters["sell_signal_threshold"] = -parameters["buy_signal_threshold"]
+            #signal_model["sell_slope_threshold"] = -signal_model["buy_slope_threshold"]
+            if parameters.get("buy_signal_threshold_2") is not None:
+                parameters["sell_signal_threshold_2"] = -parameters["buy_signal_threshold_2"]
+
+    if generator_name in ["threshold_rule", "threshold_rule2"]:
+        #
+        # Threshold rules are evaluated directly on the score arrays for all parameters in one compiled pass (in parallel)
+        # The result is the same as generating signal columns and simulating trades for each parameter set
+        #
+        columns = signal_generator["config"].get("columns")
+        if isinstance(columns, str):
+            columns = [columns]
+        score_2 = df[columns[1]].values if generator_name == "threshold_rule2" else None
+
+        results = threshold_rule_grid_performance(df[columns[0]].values, df['close'].values, parameter_list, score_2)
+    else:
+        results = []
+        for parameters in tqdm(parameter_list, desc="MODELS"):
+            #
+            # Set new parameters of the signal generator
+            #
+            signal_generator["config"]["parameters"].update(parameters)
+
+            #
+            # Execute the signal generator with new parameters by producing new signal columns
+            #
+            df, new_features = generate_feature_set(df, signal_generator, last_rows=0)
+
+            # These boolean columns are used for performance measurement. Alternatively, they are in trade_signal_model
+            buy_signal_column = signal_generator["config"]["names"][0]
+            sell_signal_column = signal_generator["config"]["names"][1]
+
+            # Perform backtesting (lists of transactions are not needed)
+            results.append(simulated_trade_performance_arrays(
+                df[buy_signal_column].values, df[sell_signal_column].values,
+                df['close'].values
+            ))
+
+    #
+    # Simulate trade and compute performance using close price and two boolean signals
+    # Add a pair of two dicts: performance dict and model parameters dict
+    #
+    records = list()
+    for parameters, (performance, long_performance, short_performance) in zip(parameter_list, results):
+
+        if direction == "long":
+            performance = long_performance
+        elif direction == "short":
+            performance = short_performance
+
+        # Add some metrics. Add per month metrics
+        performance["profit_percent_per_month"] = performance["profit_percent"] / months_in_simulation
+        performance["transaction_no_per_month"] = performance["transaction_no"] / months_in_simulation
+        performance["profit_percent_per_transaction"] = performance["profit_percent"] / performance["transaction_no"] if performance["transaction_no"] else 0.0
+        performance["profit_per_month"] = performance["profit"] / months_in_simulation
+
+        #long_performance["profit_percent_per_month"] = long_performance["profit_percent"] / months_in_simulation
+        #short_performance["profit_percent_per_month"] = short_performance["profit_percent"] / months_in_simulation
+
+        records.append(dict(
+            model=parameters,
+            performance={k: performance[k] for k in ['profit_percent_per_month', 'profitable', 'profit_percent_per_transaction', 'transaction_no_per_month']},
+            #long_performance={k: long_performance[k] for k in ['profit_percent_per_month', 'profitable']},
+            #short_performance={k: short_performance[k] for k in ['profit_percent_per_month', 'profitable']}
+        ))
+
+    #
+    # Interval-wise precision and recall of the buy (sell) thresholds with respect to the intervals of the buy (sell) label
+    # All parameter sets are evaluated in one sweep for each label
+    #
+    if interval_labels:
+        if intervals is None:
+            intervals = find_label_intervals(df, train_signal_config)
+        columns = signal_generator["config"].get("columns")
+        score_column = columns if isinstance(columns, str) else columns[0]
+        for side, label_column in interval_labels.items():
+            pairs = [(score_column, parameters[side + "_signal_threshold"]) for parameters in parameter_list]
+            sweep = interval_precision_sweep(df, label_column, pairs, intervals[label_column], below=side == "sell")
+            for record, row in zip(records, sweep.itertuples()):
+                record["performance"][side + "_interval_precision"] = row.precision
+                record["performance"][side + "_interval_recall"] = row.recall
+
+    return records
+
+
+def find_label_intervals(df, train_signal_config: dict) -> dict:
+    """Find the contiguous intervals of each interval label column. The label of the buy (sell) thresholds is specified in the buy (sell) key."""
+    interval_labels = train_signal_config.get("interval_labels") or {}
+    unknown_sides = [side for side in interval_labels.keys() if side not in ["buy", "sell"]]
+    if unknown_sides:
+        raise ValueError(f"Unknown keys {unknown_sides} of interval labels. Only 'buy' and 'sell' are possible.")
+    return {label_column: find_intervals(df[label_column].to_numpy()) for label_column in interval_labels.values()}
+
+
+#
+# Walk-forward optimization
+#
+
+def walk_forward(df, parameter_grid: dict, signal_generator: dict, train_signal_config: dict, walk_forward_config: dict, out_path: Path, time_column: str):
+    """
+    Split the data into rolling folds each consisting of train_length train rows followed by test_length test rows (shifted by step rows).
+    The parameters are optimized on each train fold (folds are processed in parallel) and the best parameters are evaluated on the test fold.
+    Per-fold and aggregate performance is printed and stored.
+    """
+    train_length = walk_forward_config.get("train_length")
+    test_length = walk_forward_config.get("test_length")
+    step = walk_forward_config.get("step") or test_length
+    max_workers = walk_forward_config.get("max_workers", 1)
+
+    folds = [(start, start + train_length, start + train_length + test_length) for start in range(0, len(df) - train_length - test_length + 1, step)]
+    if not folds:
+        raise ValueError(f"Not enough data ({len(df)} rows) for one walk-forward fold with {train_length} train and {test_length} test rows.")
+
+    print(f"Walk-forward with {len(folds)} folds. Train length {train_length}, test length {test_length}, step {step}.")
+
+    # Each fold gets only its slice of the columns used for signal generation, backtesting and interval precision (and not all input columns)
+    columns = signal_generator.get("config", {}).get("columns") or []
+    if isinstance(columns, str):
+        columns = [columns]
+    interval_label_columns = list((train_signal_config.get("interval_labels") or {}).values())
+    fold_df = df[list(dict.fromkeys([time_column, 'close'] + columns + interval_label_columns))]
+    args = [(fold_df.iloc[train_start:test_end], train_end - train_start, parameter_grid, signal_generator, train_signal_config, time_column) for train_start, train_end, test_end in folds]
+    if max_workers > 1:
+        threads_per_worker = walk_forward_config.get("threads_per_worker") or max(1, (os.cpu_count() or 1) // max_workers)
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(folds)), mp_context=context, initializer=_init_fold_worker, initargs=(threads_per_worker,)) as executor:
+            results = list(executor.map(optimize_fold, *zip(*args)))
+    else:
+        results = [optimize_fold(*a) for a in tqdm(args, desc="FOLDS")]
+
+    #
+    # Per-fold and aggregate performance
+    #
+    rows = []
+    for (train_start, train_end, test_end), (train_record, test_record) in zip(folds, results):
+        row = dict(
+            fold=len(rows),
+            train_start=df[time_column].iloc[train_start],
+            test_start=df[time_column].iloc[train_end],
+            test_end=df[time_column].iloc[test_end - 1],
+        )
+        row.update(train_record['model'])
+        row.update({"train_" + k: v for k, v in train_record['performance'].items()})
+        row.update({"test_" + k: v for k, v in test_record['performance'].items()})
+        rows.append(row)
+
+    test_profits = np.array([row["test_profit_percent_per_month"] for row in rows])
+    aggregate = dict(
+        folds=len(rows),
+        test_profit_percent_per_month=float(test_profits.mean()),
+        test_profit_percent_per_month_std=float(test_profits.std()),
+        profitable_folds=float((test_profits > 0).mean()),
+        train_profit_percent_per_month=float(np.mean([row["train_profit_percent_per_month"] for row in rows])),
+        test_transaction_no_per_month=float(np.mean([row["test_transaction_no_per_month"] for row in rows])),
+    )
+
+    lines = [",".join([f"{v:.3f}" if isinstance(v, float) else str(v) for v in row.values()]) for row in rows]
+    aggregate_line = "aggregate," + ",".join([f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in aggregate.items()])
+
+    print("Walk-forward results:")
+    print(pd.DataFrame(rows).to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    print("Aggregate test performance: " + ", ".join([f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in aggregate.items()]))
+
+    out_path = (out_path / (App.config.get("signal_models_file_name") + "_walk_forward")).with_suffix(".txt").resolve()
+    add_header = not out_path.is_file()
+    with open(out_path, "a+") as f:
+        if add_header:
+            f.write(",".join(rows[0].keys()) + "\n")
+        f.write("\n".join(lines + [aggregate_line]) + "\n\n")
+
+    print(f"Walk-forward results stored in: {out_path}. Lines: {len(lines)}.")
+
+
+def optimize_fold(df, train_length: int, parameter_grid: dict, signal_generator: dict, train_signal_config: dict, time_column: str):
+    """Find the best parameters using the first train_length rows and evaluate them on the remaining rows. Return (train record, test record)."""
+    train_df = df.iloc[:train_length]
+    test_df = df.iloc[train_length:]
+
+    performances = optimize_parameters(train_df, parameter_grid, signal_generator, train_signal_config, time_column)
+    best = max(performances, key=lambda x: x['performance']['profit_percent_per_month'])
+
+    test_record = evaluate_parameters(test_df, [dict(best['model'])], signal_generator, train_signal_config, time_column)[0]
+
+    return best, test_record
+
+
+def _init_fold_worker(num_threads: int):
+    # Compiled grid evaluation in each worker uses only its budget of threads
+    import numba
+    numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
 
 
 if __name__ == '__main__':
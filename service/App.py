@@ -6,6 +6,8 @@ import re
 
 import pandas as pd
 
+from service.latency import LatencyStats
+
 PACKAGE_ROOT = Path(__file__).parent.parent
 #PACKAGE_PARENT = '..'
 #SCRIPT_DIR = os.path.dirname(os.path.realpath(os.path.join(os.getcwd(), os.path.expanduser(__file__))))
@@ -39,7 +41,8 @@ class App:
     trade_state_status = 0  # Something wrong with our trading logic (wrong use, inconsistent state etc. what we cannot recover)
 
     signal = None  # Latest signal "BUY", "SELL"
-    df = None  # Data from the latest analysis
+    history = None  # Data from the latest analyses (HistoryStore with the last rows)
+    latency = LatencyStats()  # Durations of the stages of the main task and of the analysis steps
 
     # Trade status
     transaction = None
@@ -84,6 +87,9 @@ class App:
         "signal_models_file_name": "signal_models",
 
         "model_folder": "MODELS",
+        "model_bundle_file_name": "models.bundle",  # All models in one file (loaded faster than individual model files)
+        "model_reload_period": 0,  # Seconds. If positive then the server checks the model folder with this period and loads new models
+        "online_learning": {},  # Models updated by the server using new labeled data, e.g., {"models": ["high_20_lc"], "period": 15}
 
         "time_column": "timestamp",
 
@@ -122,6 +128,7 @@ class App:
 
         "label_horizon": 0,  # This number of tail rows will be excluded from model training
         "train_length": 0,  # train set maximum size. algorithms may decrease this length
+        "train_parallel": {},  # Train models in parallel processes, e.g., {"max_workers": 4, "threads_per_worker": 2}
 
         # List all features to be used for training/prediction by selecting them from the result of feature generation
         # The list of features can be found in the output of the feature generation (but not all must be used)
@@ -139,6 +146,12 @@ class App:
         # ONLINE (PREDICTION) PARAMETERS
         # Minimum history length required to compute derived features
         "features_horizon": 10,
+        # If true, then each feature set computes only the last rows from the (calibrated) number of previous rows it needs
+        # All rows are recomputed at start, on gaps or if the previously computed final rows have changed
+        "incremental_analysis": False,
+        # Latency metrics of the main task. The percentiles are written to the file (if specified) after each run.
+        # A warning is logged if the main task takes longer than the warning fraction of the budget (the interval length in seconds)
+        "latency_metrics": {"file": "", "window": 1440, "budget": 60, "warning": 0.8},
 
         # ===============
         # === SIGNALS ===
@@ -4,6 +4,7 @@ import json
 import pickle
 from datetime import datetime, date, timedelta
 import queue
+import threading
 
 import numpy as np
 import pandas as pd
@@ -14,6 +15,8 @@ from common.classifiers import *
 from common.model_store import *
 from common.generators import generate_feature_set
 from common.generators import predict_feature_set
+from service.kline_buffer import KlineBuffer, DataSourceAligner
+from service.history_store import HistoryStore
 
 from scripts.merge import *
 from scripts.features import *
@@ -44,10 +47,19 @@ class Analyzer:
         # Data state
         #
 
-        # Klines are stored as a dict of lists. Key is a symbol and the list is a list of latest kline records
-        # One kline record is a list of values (not dict) as returned by API: open time, open, high, low, close, volume etc.
+        # Klines are stored as a dict of kline buffers. Key is a symbol and the buffer stores the latest kline records
+        # One kline record has the values (parsed) as returned by API: open time, open, high, low, close, volume etc.
         self.klines = {}
 
+        # Klines of all data sources aligned in time (one time slot per minute)
+        data_sources = App.config.get("data_sources", [])
+        if not data_sources:
+            data_sources = [{"folder": App.config["symbol"], "file": "klines", "column_prefix": ""}]
+        self.aligner = DataSourceAligner(data_sources, App.config["features_horizon"])
+
+        # Results of the analyses (source data, features, scores and signals) with the last rows updated in place
+        App.history = HistoryStore(App.config["features_horizon"], App.config["time_column"])
+
         self.queue = queue.Queue()
 
         #
@@ -59,11 +71,23 @@ class Analyzer:
         model_path = Path(App.config["model_folder"])
         if not model_path.is_absolute():
             model_path = data_path / model_path
-        model_path = model_path.resolve()
+        self.model_path = model_path.resolve()
 
-        labels = App.config["labels"]
-        algorithms = App.config["algorithms"]
-        self.models = load_models(model_path, labels, algorithms)
+        self.models_signature = self.get_models_signature()
+        self.models = self.load_models()
+
+        # New models loaded by the watcher thread. They are swapped in by the analysis (between scheduler ticks)
+        self.pending_models = None
+        self.models_lock = threading.Lock()
+        self.model_watcher = None
+        self.model_watcher_stop = threading.Event()
+
+        # State of incremental analysis: output columns of each feature set, number of previous rows it needs to compute
+        # the last rows (None means all rows), last rows with source data and features, and the last analyzed row
+        self.feature_set_columns = []
+        self.feature_contexts = []
+        self.feature_state = None
+        self.analyzed_index = None
 
         # Load latest transaction and (simulated) trade state
         App.transaction = load_last_transaction()
@@ -77,7 +101,7 @@ class Analyzer:
 
     def get_last_kline(self, symbol):
         if self.get_klines_count(symbol) > 0:
-            return self.klines.get(symbol)[-1]
+            return self.klines.get(symbol).last()
         else:
             return None
 
@@ -115,40 +139,17 @@ class Analyzer:
             # If symbol does not exist then create
             klines_data = self.klines.get(symbol)
             if klines_data is None:
-                self.klines[symbol] = []
+                self.klines[symbol] = KlineBuffer(App.config["features_horizon"])
                 klines_data = self.klines.get(symbol)
 
-            ts = klines[0][0]  # Very first timestamp of the new data
-
-            # Find kline with this or younger timestamp in the database
-            # same_kline = next((x for x in klines_data if x[0] == ts), None)
-            existing_indexes = [i for i, x in enumerate(klines_data) if x[0] >= ts]
-            #print(f"===>>> Existing tss: {[x[0] for x in klines_data]}")
-            #print(f"===>>> New tss: {[x[0] for x in klines]}")
-            #print(f"===>>> {symbol} Overlap {len(existing_indexes)}. Existing Indexes: {existing_indexes}")
-            if existing_indexes:  # If there is overlap with new klines
-                start = min(existing_indexes)
-                num_deleted = len(klines_data) - start
-                del klines_data[start:]  # Delete starting from the first kline in new data (which will be added below)
-                if len(klines) < num_deleted:  # It is expected that we add same or more klines than deleted
-                    log.error("More klines is deleted by new klines added, than we actually add. Something woring with timestamps and storage logic.")
-
-            # Append new klines
-            klines_data.extend(klines)
-
-            # Remove too old klines
-            kline_window = App.config["features_horizon"]
-            to_delete = len(klines_data) - kline_window
-            if to_delete > 0:
-                del klines_data[:to_delete]
-
-            # Check validity. It has to be an ordered time series with certain frequency
-            for i, kline in enumerate(self.klines.get(symbol)):
-                ts = kline[0]
-                if i > 0:
-                    if ts - prev_ts != 60_000:
-                        log.error("Wrong sequence of klines. They are expected to be a regular time series with 1m frequency.")
-                prev_ts = kline[0]
+            # Overwrite klines with this or younger timestamp and append the rest. Too old klines are removed
+            num_deleted = klines_data.store(klines)
+            if len(klines) < num_deleted:  # It is expected that we add same or more klines than deleted
+                log.error("More klines is deleted by new klines added, than we actually add. Something woring with timestamps and storage logic.")
+
+            # Check validity of the new klines and their connection to the existing klines. It has to be an ordered time series with certain frequency
+            if not klines_data.is_regular(len(klines) + 1):
+                log.error("Wrong sequence of klines. They are expected to be a regular time series with 1m frequency.")
 
             # Debug message about the last received kline end and current ts (which must be less than 1m - rather small delay)
             log.debug(f"Stored klines. Total {len(klines_data)} in db. Last kline end: {self.get_last_kline_ts(symbol)+60_000}. Current time: {now_ts}")
@@ -247,10 +248,144 @@ class Analyzer:
                 with open(file, 'a+') as f:
                     f.write(data_str + "\n")
 
+    #
+    # Models
+    #
+
+    def load_models(self):
+        labels = App.config["labels"]
+        algorithms = App.config["algorithms"]
+        return load_models(self.model_path, labels, algorithms, App.config.get("model_bundle_file_name"))
+
+    def get_models_signature(self):
+        """Names, sizes and modification times of all files in the model folder. It changes if models are re-trained or copied."""
+        if not self.model_path.is_dir():
+            return ()
+        signature = []
+        for file in sorted(self.model_path.iterdir()):
+            if not file.is_file():
+                continue
+            stat = file.stat()
+            signature.append((file.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def start_model_watcher(self, period: float):
+        """Start a background thread which checks the model folder every period seconds and loads new models."""
+        self.model_watcher = threading.Thread(target=self.watch_models, args=(period,), name="model_watcher", daemon=True)
+        self.model_watcher.start()
+        log.info(f"Started watching models in {self.model_path} every {period} seconds.")
+
+    def watch_models(self, period: float):
+        """
+        Load models after the files in the model folder have changed. The models are loaded only if the folder
+        has not changed during the last period (so that the files are not loaded while they are being written).
+        """
+        last_signature = self.models_signature
+        while not self.model_watcher_stop.wait(period):
+            signature = self.get_models_signature()
+            if signature == self.models_signature or signature != last_signature:
+                last_signature = signature  # Nothing new or still changing
+                continue
+
+            try:
+                start = datetime.now()
+                models = self.load_models()
+            except Exception as e:
+                log.error(f"Error loading new models from {self.model_path}. Old models will be used. {e}")
+                self.models_signature = signature  # Do not try again until the files change
+                continue
+
+            with self.models_lock:
+                self.pending_models = models
+            self.models_signature = signature
+            elapsed = datetime.now() - start
+            log.info(f"Loaded new models {list(models.keys())} in {elapsed.total_seconds():.2f} seconds.")
+
+    def swap_models(self):
+        """Use the new models (if any) loaded by the watcher. It is done atomically before the analysis starts."""
+        with self.models_lock:
+            models, self.pending_models = self.pending_models, None
+        if models is not None:
+            self.models = models
+            log.info("Switched to new models.")
+
+    def publish_models(self, models: dict, base_models: dict):
+        """
+        Replace some of the models (e.g., updated by online learning) starting from the next analysis.
+        A model is replaced only if its base version is still used, that is, it has not been replaced by newly loaded models.
+        """
+        with self.models_lock:
+            current_models = self.pending_models if self.pending_models is not None else self.models
+            published = {name: pair for name, pair in models.items() if current_models.get(name) is base_models.get(name)}
+            if published:
+                self.pending_models = dict(current_models, **published)
+        return list(published.keys())
+
     #
     # Analysis (features, predictions, signals etc.)
     #
 
+    def generate_features_full(self, df, feature_sets: list, last_rows: int, ignore_last_rows: bool):
+        """
+        Apply all feature sets to the data frame. In incremental mode, all rows are computed and the state for the next analyses is created:
+        the number of previous rows needed by each feature set is found by comparing its results with those computed from all rows.
+        """
+        incremental = App.config.get("incremental_analysis")
+
+        self.feature_set_columns = []
+        for i, fs in enumerate(feature_sets):
+            with App.latency.span(f"analyze.features.{i}.{fs.get('generator')}"):
+                df, feats = generate_feature_set(df, fs, last_rows=last_rows if not ignore_last_rows and not incremental else 0)
+            self.feature_set_columns.append(feats)
+
+        if incremental:
+            rows = incremental_rows(last_rows)
+            with App.latency.span("analyze.features.calibration"):
+                self.feature_contexts = [find_feature_context(df, fs, feats, rows) for fs, feats in zip(feature_sets, self.feature_set_columns)]
+            if None in self.feature_contexts:
+                self.feature_state = df
+            else:
+                self.feature_state = df.iloc[-(max(self.feature_contexts) + rows):]
+            log.info(f"Full analysis. Previous rows needed by the feature sets: {self.feature_contexts}")
+
+        return df
+
+    def generate_features_incremental(self, df, feature_sets: list, last_rows: int):
+        """
+        Compute the features of only the last rows. Each feature set gets only the previous rows it needs. The features of
+        older rows are taken from the previous analysis. Return None if all rows have to be computed: there is no previous
+        analysis, there are too many new rows (or a gap), or the features of the final rows differ from the previous analysis.
+        """
+        state = self.feature_state
+        if state is None or self.analyzed_index not in df.index:
+            return None
+        rows = incremental_rows(last_rows)
+        new_rows = len(df) - 1 - df.index.get_loc(self.analyzed_index)
+        if new_rows + 2 > rows:  # At least one of the computed rows has to be final (not updated) for the consistency check
+            log.info(f"Too many new rows ({new_rows}) for incremental analysis of {rows} last rows.")
+            return None
+
+        # Source data of the last rows and the previously computed features (the new rows do not have them yet)
+        derived_columns = [c for feats in self.feature_set_columns for c in feats]
+        features_df = df.iloc[-len(state):].join(state[derived_columns])
+
+        for i, (fs, feats, context) in enumerate(zip(feature_sets, self.feature_set_columns, self.feature_contexts)):
+            with App.latency.span(f"analyze.features_incremental.{i}.{fs.get('generator')}"):
+                tail_df = features_df.iloc[-(context + rows):] if context is not None else features_df
+                tail_df, _ = generate_feature_set(tail_df.drop(columns=feats), fs, last_rows=rows)
+                features_df.iloc[-rows:, features_df.columns.get_indexer(feats)] = tail_df[feats].iloc[-rows:].to_numpy()
+
+        # Rows which were final in the previous analysis (the last analyzed row might have been updated) must not change
+        final_index = features_df.index[-rows:][features_df.index[-rows:] < self.analyzed_index]
+        old_values = state.loc[final_index, derived_columns].to_numpy(dtype=float)
+        new_values = features_df.loc[final_index, derived_columns].to_numpy(dtype=float)
+        if not np.allclose(old_values, new_values, rtol=1e-9, atol=1e-12, equal_nan=True):
+            log.warning(f"Incrementally computed features of the rows {final_index.tolist()} differ from the previous analysis. All rows are computed.")
+            return None
+
+        self.feature_state = features_df
+        return features_df
+
     def analyze(self, ignore_last_rows=False):
         """
         1. Convert klines to df
@@ -260,6 +395,10 @@ class Analyzer:
         """
         symbol = App.config["symbol"]
 
+        # One analysis always uses one set of models even if new models are loaded in the meantime
+        self.swap_models()
+        models = self.models
+
         # Features, predictions, signals etc. have to be computed only for these last rows (for performance reasons)
         last_rows = App.config["features_last_rows"]
 
@@ -268,40 +407,25 @@ class Analyzer:
 
         log.info(f"Analyze {symbol}. Last kline timestamp: {last_kline_ts_str}")
 
-        #
-        # Convert source data (klines) into data frames for each source
-        #
-        data_sources = App.config.get("data_sources", [])
-        if not data_sources:
-            data_sources = [{"folder": App.config["symbol"], "file": "klines", "column_prefix": ""}]
-
-        # Read data from online sources into data frames
-        for ds in data_sources:
-            if ds.get("file") == "klines":
-                try:
-                    klines = self.klines.get(ds.get("folder"))
-                    df = klines_to_df(klines)
-
-                    # Validate
-                    source_columns = ['open', 'high', 'low', 'close', 'volume', 'close_time', 'quote_av', 'trades', 'tb_base_av', 'tb_quote_av']
-                    if df.isnull().any().any():
-                        null_columns = {k: v for k, v in df.isnull().any().to_dict().items() if v}
-                        log.warning(f"Null in source data found. Columns with Null: {null_columns}")
-                    # TODO: We might receive empty strings or 0s in numeric data - how can we detect them?
-                    # TODO: Check that timestamps in 'close_time' are strictly consecutive
-                except Exception as e:
-                    log.error(f"Error in klines_to_df method: {e}. Length klines: {len(klines)}")
-                    return
-            else:
-                log.error("Unknown data sources. Currently only 'klines' is supported. Check 'data_sources' in config, key 'file'")
-                return
-            ds["df"] = df
-
         #
         # 1.
-        # MERGE multiple dfs in one df with prefixes and common regular time index
+        # Write new klines of each source into their time slots and MERGE them into one df with prefixes and common regular time index
         #
-        df = merge_data_sources(data_sources)
+        if any(ds.get("file") != "klines" for ds in self.aligner.data_sources):
+            log.error("Unknown data sources. Currently only 'klines' is supported. Check 'data_sources' in config, key 'file'")
+            return
+        try:
+            with App.latency.span("analyze.merge"):
+                self.aligner.update(self.klines)
+                df = self.aligner.to_df(App.config["time_column"])
+
+            # Validate
+            gaps = {k: v for k, v in self.aligner.gaps().items() if v}
+            if gaps:
+                log.warning(f"Missing klines in source data found. Number of missing klines: {gaps}")
+        except Exception as e:
+            log.error(f"Error in merging source data: {e}. Number of klines: { {k: len(v) for k, v in self.klines.items()} }")
+            return
 
         #
         # 2.
@@ -313,10 +437,13 @@ class Analyzer:
             return
 
         # Apply all feature generators to the data frame which get accordingly new derived columns
-        feature_columns = []
-        for fs in feature_sets:
-            df, feats = generate_feature_set(df, fs, last_rows=last_rows if not ignore_last_rows else 0)
-            feature_columns.extend(feats)
+        features_df = None
+        if App.config.get("incremental_analysis") and not ignore_last_rows:
+            features_df = self.generate_features_incremental(df, feature_sets, last_rows)
+        if features_df is None:
+            features_df = self.generate_features_full(df, feature_sets, last_rows, ignore_last_rows)
+        df = features_df
+        self.analyzed_index = df.index[-1]
 
         # Shorten the data frame. Only several last rows will be needed and not the whole data context
         if not ignore_last_rows:
@@ -345,15 +472,20 @@ class Analyzer:
             return
 
         # Apply all train feature generators to the data frame by generating predicted columns
-        score_df = pd.DataFrame(index=predict_df.index)
+        score_dfs = []
         train_feature_columns = []
+        latencies = {}  # Prediction time of each model
         for fs in train_feature_sets:
-            fs_df, feats, _ = predict_feature_set(predict_df, fs, App.config, self.models)
-            score_df = pd.concat([score_df, fs_df], axis=1)
+            fs_df, feats, _ = predict_feature_set(predict_df, fs, App.config, models, latencies)
+            score_dfs.append(fs_df)
             train_feature_columns.extend(feats)
 
         # Attach all predicted features to the main data frame
-        df = pd.concat([df, score_df], axis=1)
+        df = pd.concat([df] + score_dfs, axis=1)
+
+        log.debug("Model prediction times (ms): " + ", ".join([f"{k}={v * 1000:.1f}" for k, v in latencies.items()]))
+        for name, seconds in latencies.items():
+            App.latency.add(f"analyze.model.{name}", seconds)
 
         #
         # 4.
@@ -365,9 +497,12 @@ class Analyzer:
             return
 
         # Apply all feature generators to the data frame which get accordingly new derived columns
+        # A full analysis computes all rows in streaming mode so that the state of streaming generators (smoothing) is built from all rows
+        signal_last_rows = len(df) if ignore_last_rows else last_rows
         signal_columns = []
-        for fs in signal_sets:
-            df, feats = generate_feature_set(df, fs, last_rows=last_rows if not ignore_last_rows else 0)
+        for i, fs in enumerate(signal_sets):
+            with App.latency.span(f"analyze.signals.{i}.{fs.get('generator')}"):
+                df, feats = generate_feature_set(df, fs, last_rows=signal_last_rows)
             signal_columns.extend(feats)
 
         #
@@ -379,8 +514,8 @@ class Analyzer:
         scores = ", ".join([f"{x}={row[x]:+.3f}" if isinstance(row[x], float) else f"{x}={str(row[x])}" for x in signal_columns])
         log.info(f"Analyze finished. Close: {int(row['close']):,} Signals: {scores}")
 
-        if App.df is None or len(App.df) == 0:
-            App.df = df
+        if len(App.history) == 0:
+            App.history.upsert(df)
             return
 
         # Test if newly retrieved and computed values are equal to the previous ones
@@ -388,26 +523,40 @@ class Analyzer:
         num_cols = df.select_dtypes((float, int)).columns.tolist()
         # Loop over several last newly computed data rows
         # Skip last row because it should not exist, and before the last row because its kline is frequently updated after retrieval
-        for r in range(2, check_row_count):
+        for r in range(2, min(check_row_count, len(df))):
             idx = df.index[-r-1]
 
-            if idx not in App.df.index:
-                continue
-
             # Compare all numeric values of the previously retrieved and newly retrieved rows for the same time
-            old_row = App.df[num_cols].loc[idx]
+            old_row = App.history.get_row(idx, num_cols)
+            if old_row is None:
+                continue
             new_row = df[num_cols].loc[idx]
-            comp_idx = np.isclose(old_row, new_row)
+            comp_idx = np.isclose(old_row, new_row, equal_nan=True)
             if not np.all(comp_idx):
                 log.warning(f"Newly computed row is not equal to the previously computed row for '{idx}'. NEW: {new_row[~comp_idx].to_dict()}. OLD: {old_row[~comp_idx].to_dict()}")
 
-        # Append new rows to the main data frame
-        App.df = df.tail(check_row_count).combine_first(App.df)
+        # Write new rows into the history (the oldest rows are removed by the store)
+        App.history.upsert(df.tail(check_row_count))
+
+
+def incremental_rows(last_rows: int):
+    """Number of the last rows computed by incremental analysis: at least a new row, the previously last (updated) row and one final row."""
+    return max(last_rows, 3)
 
-        # Remove too old rows
-        features_horizon = App.config["features_horizon"]
-        if len(App.df) > features_horizon + 15:
-            App.df = App.df.tail(features_horizon)
+
+def find_feature_context(df, fs: dict, feats: list, last_rows: int):
+    """
+    Find the number of previous rows which are enough for the feature set to compute the features of the last rows
+    equal to those in the data frame (computed from all rows). Return None if all rows are needed.
+    """
+    expected = df[feats].iloc[-last_rows:].to_numpy(dtype=float)
+    context = 16
+    while context + last_rows < len(df):
+        tail_df, _ = generate_feature_set(df.iloc[-(context + last_rows):].drop(columns=feats), fs, last_rows=last_rows)
+        if np.allclose(tail_df[feats].iloc[-last_rows:].to_numpy(dtype=float), expected, rtol=1e-9, atol=1e-12, equal_nan=True):
+            return context
+        context *= 2
+    return None
 
 
 if __name__ == "__main__":
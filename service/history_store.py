@@ -0,0 +1,150 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+"""
+History of the analysis results (source data, features, scores and signals) of the server.
+The history has a fixed capacity and its columns are preallocated so that the results of each analysis
+are written (inserted or updated) in place instead of creating a new data frame every minute.
+"""
+
+
+class HistoryStore:
+    """
+    Fixed-capacity columnar ring buffer with a time index.
+
+    Each column is a numpy array where each row is written at two positions (i and i + capacity) so that the stored rows are
+    always one contiguous part of the array. Data frames with the last rows are created from read-only views without copying.
+    Rows with new (later) timestamps are appended and the oldest rows are removed if the capacity is exceeded.
+    Rows with existing timestamps are updated in place (only non-null values overwrite the stored values as in combine_first).
+    Writing and reading are synchronized by a lock. Readers in other threads (which might run during an upsert) have to get a copy.
+    """
+
+    def __init__(self, capacity: int, index_name: str = "timestamp"):
+        self.capacity = capacity
+        self.index_name = index_name
+        self.index = np.zeros(2 * capacity, dtype=np.int64)  # Timestamps in ns
+        self.index_dtype = None  # Type of the index of the stored data frames
+        self.columns = {}  # Column name and array with its values
+        self.start = 0  # Position of the oldest row
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def last_index(self):
+        with self.lock:
+            return pd.Timestamp(self.index[self.start + self.count - 1]) if self.count else None
+
+    def upsert(self, df: pd.DataFrame):
+        """Insert the rows with new timestamps and update the rows with existing timestamps. The index of the data frame is sorted."""
+        if len(df) == 0:
+            return
+        with self.lock:
+            self._upsert(df)
+
+    def _upsert(self, df: pd.DataFrame):
+        ts = df.index.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        if self.index_dtype is None:
+            self.index_dtype = df.index.dtype
+
+        for name in df.columns:
+            if name not in self.columns:
+                self.columns[name] = _empty_column(df[name].dtype, 2 * self.capacity)
+
+        # Existing rows (older rows which are not stored anymore are ignored)
+        last_ts = self.index[self.start + self.count - 1] if self.count else np.iinfo(np.int64).min
+        is_new = ts > last_ts
+        stored_index = self.index[self.start:self.start + self.count]
+        offsets = np.searchsorted(stored_index, ts[~is_new])  # Relative to the oldest row
+        is_found = offsets < self.count
+        is_found[is_found] = stored_index[offsets[is_found]] == ts[~is_new][is_found]
+        rows = np.flatnonzero(~is_new)[is_found]
+        offsets = offsets[is_found]
+
+        # Make space for new rows by removing the oldest rows
+        new_rows = np.flatnonzero(is_new)[-self.capacity:]
+        to_delete = self.count + len(new_rows) - self.capacity
+        if to_delete > 0:
+            self.start = (self.start + to_delete) % self.capacity
+            self.count -= to_delete
+            offsets = offsets - to_delete
+            rows, offsets = rows[offsets >= 0], offsets[offsets >= 0]
+        positions = (self.start + offsets) % self.capacity
+
+        # New rows are initialized with empty values
+        new_positions = (self.start + self.count + np.arange(len(new_rows))) % self.capacity
+        self.count += len(new_rows)
+        for p in (new_positions, new_positions + self.capacity):
+            self.index[p] = ts[new_rows]
+            for values in self.columns.values():
+                values[p] = _empty_value(values.dtype)
+
+        # Write the values of new and existing rows
+        rows = np.concatenate([rows, new_rows])
+        positions = np.concatenate([positions, new_positions])
+        for name in df.columns:
+            values = self.columns[name]
+            new_values = df[name].to_numpy()[rows].astype(values.dtype)
+            is_set = ~pd.isnull(new_values)
+            for p in (positions, positions + self.capacity):
+                values[p[is_set]] = new_values[is_set]
+
+    def tail(self, n: int = None, columns: list = None, copy: bool = False) -> pd.DataFrame:
+        """
+        Data frame with the last n rows (all rows by default) which uses read-only views of the stored arrays.
+        If copy is true, then the values are copied (under the lock) so that later upserts do not change them.
+        """
+        with self.lock:
+            n = self.count if n is None else min(n, self.count)
+            end = self.start + self.count
+            columns = list(self.columns.keys()) if columns is None else columns
+
+            data = {}
+            for name in columns:
+                view = self.columns[name][end - n:end]
+                if copy:
+                    view = view.copy()
+                else:
+                    view.flags.writeable = False
+                data[name] = view
+            index = pd.DatetimeIndex(self.index[end - n:end].astype("datetime64[ns]"), name=self.index_name).astype(self.index_dtype or "datetime64[ns]")
+
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def get_row(self, idx, columns: list):
+        """Values of the columns in the row with the specified timestamp or None if there is no such row."""
+        with self.lock:
+            return self._get_row(idx, columns)
+
+    def _get_row(self, idx, columns: list):
+        stored_index = self.index[self.start:self.start + self.count]
+        ts = pd.Timestamp(idx).as_unit("ns").value
+        position = int(np.searchsorted(stored_index, ts))
+        if position >= self.count or stored_index[position] != ts or any(name not in self.columns for name in columns):
+            return None
+        return pd.Series([self.columns[name][self.start + position] for name in columns], index=columns, name=idx)
+
+
+def _empty_column(dtype, length: int) -> np.ndarray:
+    if dtype == bool:
+        return np.zeros(length, dtype=bool)
+    elif pd.api.types.is_datetime64_dtype(dtype):
+        return np.full(length, np.datetime64("NaT"), dtype=dtype)
+    elif pd.api.types.is_numeric_dtype(dtype):
+        return np.full(length, np.nan)
+    else:
+        return np.full(length, None, dtype=object)
+
+
+def _empty_value(dtype):
+    if dtype == bool:
+        return False
+    elif dtype.kind == "M":
+        return np.datetime64("NaT")
+    elif dtype.kind == "f":
+        return np.nan
+    else:
+        return None
@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+
+"""
+Typed in-memory storage of the latest klines used by the analyzer instead of lists of (string) values.
+Klines are parsed once when they are stored and then the data frame for feature generation is created from the numeric columns.
+Klines of several symbols (data sources) are aligned in time incrementally instead of merging all data frames each time.
+"""
+
+# Kline fields in the order returned by the API
+kline_dtype = np.dtype([
+    ('timestamp', np.int64),
+    ('open', np.float64), ('high', np.float64), ('low', np.float64), ('close', np.float64), ('volume', np.float64),
+    ('close_time', np.int64),
+    ('quote_av', np.float64), ('trades', np.int64), ('tb_base_av', np.float64), ('tb_quote_av', np.float64),
+    ('ignore', np.float64),
+])
+
+
+class KlineBuffer:
+    """
+    Fixed-capacity ring buffer of klines stored in a structured numpy array.
+
+    Each kline is written at two positions (i and i + capacity) so that the stored klines are always
+    one contiguous slice of the array and can be accessed as column views without copying.
+    New klines overwrite the stored klines with the same or later timestamps (found by binary search)
+    and the oldest klines are removed if the capacity is exceeded.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=kline_dtype)
+        self.start = 0  # Position of the oldest kline
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def view(self) -> np.ndarray:
+        """Structured array with all stored klines from the oldest to the latest (without copying)."""
+        return self.data[self.start:self.start + self.count]
+
+    def column(self, name: str) -> np.ndarray:
+        """Values of one field of all stored klines (without copying)."""
+        return self.view()[name]
+
+    def last(self):
+        """The latest kline as a list of values in the API order (like the lists which are stored) or None."""
+        if not self.count:
+            return None
+        return list(self.data[self.start + self.count - 1].tolist())
+
+    def last_timestamp(self) -> int:
+        return int(self.data[self.start + self.count - 1]['timestamp']) if self.count else 0
+
+    def store(self, klines: list) -> int:
+        """Store klines (lists of values as returned by the API) and return the number of overwritten klines."""
+        new = to_kline_array(klines)
+        if len(new) == 0:
+            return 0
+
+        # Remove the stored klines with the same or later timestamps
+        position = int(np.searchsorted(self.column('timestamp'), new['timestamp'][0], side='left'))
+        num_deleted = self.count - position
+        self.count = position
+
+        if len(new) > self.capacity:
+            new = new[-self.capacity:]
+
+        # Remove the oldest klines to free space for the new klines
+        to_delete = self.count + len(new) - self.capacity
+        if to_delete > 0:
+            self.start = (self.start + to_delete) % self.capacity
+            self.count -= to_delete
+
+        positions = (self.start + self.count + np.arange(len(new))) % self.capacity
+        self.data[positions] = new
+        self.data[positions + self.capacity] = new
+        self.count += len(new)
+
+        return num_deleted
+
+    def is_regular(self, last_n: int, step: int = 60_000) -> bool:
+        """Whether the timestamps of the last_n stored klines follow each other with the specified step (in ms)."""
+        ts = self.column('timestamp')[-last_n:]
+        return bool(np.all(np.diff(ts) == step))
+
+    def to_df(self) -> pd.DataFrame:
+        """Data frame with the same columns and types as produced by klines_to_df for the list of stored klines (except for the numeric ignore column)."""
+        view = self.view()
+        df = pd.DataFrame({name: view[name] for name in kline_dtype.names if name != 'timestamp'})
+        df['close_time'] = pd.to_datetime(df['close_time'], unit='ms')
+        df.index = pd.to_datetime(view['timestamp'], unit='ms')
+        df.index.name = 'timestamp'
+        return df
+
+
+def to_kline_array(klines: list) -> np.ndarray:
+    """Parse klines (lists of numbers or strings as returned by the API) into a structured array."""
+    out = np.empty(len(klines), dtype=kline_dtype)
+    if len(klines) == 0:
+        return out
+    values = np.array([kline[:len(kline_dtype.names)] for kline in klines], dtype=object)
+    for i, name in enumerate(kline_dtype.names):
+        out[name] = values[:, i].astype(kline_dtype[name])
+    return out
+
+
+class DataSourceAligner:
+    """
+    Preallocated buffer with one time slot per kline interval for all data sources (symbols) stored in kline buffers.
+
+    The slots cover the last capacity intervals. When new klines are stored, the time axis is moved forward and only the
+    klines which are new (or updated) for each source are written into their slots. The slots which have not been written
+    for a source are gaps. The merged data frame is the same as produced by merge_data_sources for the data frames of all sources
+    (if the sources are not older than the last capacity slots).
+    As in kline buffers, each slot is written at two positions so that the slots are always one contiguous part of the arrays.
+    """
+
+    def __init__(self, data_sources: list, capacity: int, step: int = 60_000):
+        self.data_sources = data_sources
+        self.capacity = capacity
+        self.step = step  # Length of one time slot in ms
+        self.columns = [name for name in kline_dtype.names if name != 'timestamp']
+
+        self.values = np.full((len(data_sources), 2 * capacity, len(self.columns)), np.nan)
+        self.filled = np.zeros((len(data_sources), 2 * capacity), dtype=bool)
+        self.start = 0  # Position of the oldest slot
+        self.count = 0  # Number of slots
+        self.end_ts = None  # Timestamp of the latest slot
+
+        self.written_ts = [None] * len(data_sources)  # Timestamp of the latest kline written for each source
+
+    def update(self, klines: dict) -> int:
+        """Write the new klines of all data sources from the kline buffers (key is the folder of the data source). Return the number of written klines."""
+        written = 0
+        for i, ds in enumerate(self.data_sources):
+            buffer = klines.get(ds.get("folder"))
+            if buffer is None or len(buffer) == 0:
+                continue
+            view = buffer.view()
+
+            # The latest written kline is written again because it might have been updated
+            first = 0 if self.written_ts[i] is None else int(np.searchsorted(view['timestamp'], self.written_ts[i], side='left'))
+            new = view[first:]
+            if len(new) == 0:
+                continue
+
+            self._extend(int(new['timestamp'][-1]))
+
+            self.written_ts[i] = int(new['timestamp'][-1])
+
+            # Klines older than the oldest slot are not needed
+            offsets = (self.end_ts - new['timestamp']) // self.step
+            new = new[offsets < self.count]
+            positions = (self.start + self.count - 1 - offsets[offsets < self.count]) % self.capacity
+
+            rows = np.column_stack([new[name].astype(np.float64) for name in self.columns])
+            for p in (positions, positions + self.capacity):
+                self.values[i, p] = rows
+                self.filled[i, p] = True
+
+            written += len(new)
+
+        return written
+
+    def _extend(self, ts: int):
+        """Move the time axis forward so that the latest slot has the specified timestamp. New slots are empty (gaps)."""
+        if self.end_ts is None:
+            self.end_ts = ts
+            self.count = self.capacity
+            return
+        k = (ts - self.end_ts) // self.step
+        if k <= 0:
+            return
+        k_new = min(k, self.capacity)
+        positions = (self.start + self.count + np.arange(k - k_new, k)) % self.capacity
+        self._clear(positions)
+        to_delete = self.count + k - self.capacity
+        if to_delete > 0:
+            self.start = (self.start + to_delete) % self.capacity
+            self.count -= to_delete
+        self.count += k
+        self.end_ts = ts
+
+    def _clear(self, positions):
+        for p in (positions, positions + self.capacity):
+            self.values[:, p] = np.nan
+            self.filled[:, p] = False
+
+    def gaps(self) -> dict:
+        """Number of slots without klines for each data source (key is the folder) within the merged range."""
+        start, end = self._range()
+        return {ds.get("folder"): int(end - start - self.filled[i, start:end].sum()) for i, ds in enumerate(self.data_sources)}
+
+    def _range(self):
+        """Positions of the first and after the last slot of the merged range (from the first kline of any source to the latest kline of all sources)."""
+        if self.end_ts is None or any(ts is None for ts in self.written_ts):
+            return self.start, self.start
+        end_ts = min(self.written_ts)
+        end = self.start + self.count - (self.end_ts - end_ts) // self.step
+        any_filled = np.flatnonzero(self.filled[:, self.start:end].any(axis=0))
+        start = self.start + int(any_filled[0]) if len(any_filled) else end
+        return start, end
+
+    def to_df(self, time_column: str = "timestamp") -> pd.DataFrame:
+        """Data frame with the columns of all data sources (with their prefixes) for the merged range of time slots."""
+        start, end = self._range()
+        first_ts = self.end_ts - (self.start + self.count - 1 - start) * self.step if end > start else 0
+        index = pd.date_range(pd.to_datetime(first_ts, unit='ms'), periods=end - start, freq=pd.Timedelta(milliseconds=self.step), unit='ms')
+
+        columns = {}
+        for i, ds in enumerate(self.data_sources):
+            prefix = ds.get('column_prefix')
+            for j, name in enumerate(self.columns):
+                values = self.values[i, start:end, j]
+                if name == 'close_time':
+                    values = pd.to_datetime(values, unit='ms')
+                elif kline_dtype[name] == np.int64 and not np.isnan(values).any():
+                    values = values.astype(np.int64)
+                columns[prefix + "_" + name if prefix else name] = values
+
+        df = pd.DataFrame(columns, index=index)
+        df.index.name = time_column
+        return df
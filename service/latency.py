@@ -0,0 +1,67 @@
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+
+"""
+Latency measurements of the server hot path (collection, analysis, notifications, trade).
+Durations of named spans are measured with the monotonic clock (perf_counter) and the last values
+of each span are kept in rolling windows from which the percentiles are computed and written to a metrics file.
+"""
+
+
+class LatencyStats:
+    """
+    Rolling windows with the last durations (in seconds) of each span.
+    """
+
+    def __init__(self, window: int = 1440):
+        self.window = window  # Number of the last values of each span used for the percentiles
+        self.spans = {}  # Span name and deque with its last durations
+
+    def add(self, name: str, seconds: float):
+        values = self.spans.get(name)
+        if values is None:
+            values = self.spans[name] = deque(maxlen=self.window)
+        values.append(seconds)
+
+    @contextmanager
+    def span(self, name: str):
+        """Measure the duration of the block (also if it raises an exception)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def last(self, name: str, default: float = 0.0) -> float:
+        values = self.spans.get(name)
+        return values[-1] if values else default
+
+    def summary(self) -> dict:
+        """Last value and percentiles (in ms) of each span for its rolling window."""
+        summary = {}
+        for name, values in self.spans.items():
+            if not values:
+                continue
+            ms = np.array(values) * 1000.0
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            summary[name] = dict(
+                last=round(float(ms[-1]), 3),
+                p50=round(float(p50), 3), p95=round(float(p95), 3), p99=round(float(p99), 3),
+                max=round(float(ms.max()), 3),
+                count=len(ms),
+            )
+        return summary
+
+    def write(self, file_name: Union[str, Path]):
+        """Write the summary to a JSON file. The file is replaced at once so that readers never see a partially written file."""
+        file_path = Path(file_name)
+        tmp_path = file_path.with_name(file_path.name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(dict(updated=time.time(), window=self.window, spans=self.summary()), f, indent=2)
+        tmp_path.replace(file_path)
@@ -0,0 +1,155 @@
+import copy
+import warnings
+
+import numpy as np
+
+from service.App import *
+from common.utils import *
+from common.classifiers import *
+from common.model_store import *
+from common.generators import generate_feature_set
+
+import logging
+log = logging.getLogger('learner')
+
+"""
+Online (incremental) learning of linear models in the server.
+The rows of the analysis history whose labels are already known (older than label horizon) are used to update the models.
+The updated models are published to the analyzer which uses them starting from the next analysis.
+"""
+
+learned_until = {}  # Key is a score column name and value is the updated model and the timestamp of the last row used for its update
+
+
+async def online_learner_task():
+    """This task is executed regularly according to the schedule. It does the work in a thread so that analysis is not blocked."""
+    try:
+        await App.loop.run_in_executor(None, update_online_models)
+    except Exception as e:
+        log.error(f"Error in online learning: {e}")
+
+
+def update_online_models():
+    """
+    Update the models listed in the online learning configuration using the newest labeled rows and publish them to the analyzer.
+
+    Only linear models (lc) can be updated. They are re-fitted on the last window labeled rows
+    starting from their current coefficients (warm start) with few iterations.
+    A model is updated only if new labeled rows have been added since its last update.
+    """
+    learner_config = App.config.get("online_learning", {})
+    score_column_names = learner_config.get("models", [])
+    window = learner_config.get("window", 1440)
+    max_iter = learner_config.get("max_iter", 10)
+
+    if App.history is None or len(App.history) == 0:
+        return
+    df = App.history.tail(copy=True)  # The analyzer (in another thread) writes the last rows of the history in place
+
+    #
+    # Compute labels. The labels of the last label_horizon rows are not known yet
+    #
+    for fs in App.config.get("label_sets", []):
+        df, _ = generate_feature_set(df, fs, last_rows=0)
+
+    label_horizon = App.config["label_horizon"]
+    if label_horizon:
+        df = df.iloc[:-label_horizon]
+    df = df.tail(window)
+
+    base_models = App.analyzer.models  # Current models (they might be replaced while we are learning)
+
+    updated_models = {}
+    for score_column_name in score_column_names:
+        model_pair = base_models.get(score_column_name)
+        if model_pair is None:
+            log.warning(f"Model '{score_column_name}' for online learning not found.")
+            continue
+
+        model_def = find_model_definition(score_column_name)
+        if model_def is None:
+            log.warning(f"Model '{score_column_name}' for online learning not found in train feature sets.")
+            continue
+        label, model_config, train_features = model_def
+        if model_config.get("algo") != "lc":
+            log.warning(f"Model '{score_column_name}' cannot be updated online. Only lc models are supported.")
+            continue
+
+        # Continue from the last update only if this model is still used (it might have been replaced by newly loaded models)
+        model = model_pair[0]
+        last_update = learned_until.get(score_column_name)
+        if last_update is not None and last_update[0] is model:
+            is_new = df.index > last_update[1]
+        else:
+            is_new = np.full(len(df), True)
+
+        X, y, valid = _learning_matrix(model_pair[1], df[train_features], df[label], model_config)
+        new_rows = valid & is_new
+        if not new_rows.any():
+            continue
+        if len(np.unique(y)) < 2:
+            continue  # Both classes are needed to fit a classifier
+
+        new_model = copy.deepcopy(model)
+        new_model.set_params(warm_start=True, max_iter=max_iter)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # Few iterations do not converge
+            new_model.fit(X, y.astype(model.classes_.dtype))
+
+        updated_models[score_column_name] = (new_model, model_pair[1])
+        learned_until[score_column_name] = (new_model, df.index[new_rows][-1])
+
+    if not updated_models:
+        return
+
+    published = App.analyzer.publish_models(updated_models, base_models)
+    log.info(f"Online learning updated models {published} using data until {df.index[-1]}.")
+
+
+def find_model_definition(score_column_name: str):
+    """Find the train feature set of the model and return its label, algorithm and train features (as in train_feature_set)."""
+    for fs in App.config.get("train_feature_sets", []):
+        labels = fs.get("config").get("labels")
+        if not labels:
+            labels = App.config.get("labels")
+
+        algorithms = fs.get("config").get("functions")
+        if not algorithms:
+            algorithms = fs.get("config").get("algorithms")
+        if not algorithms:
+            algorithms = App.config.get("algorithms")
+
+        train_features = fs.get("config").get("columns")
+        if not train_features:
+            train_features = fs.get("config").get("features")
+        if not train_features:
+            train_features = App.config.get("train_features")
+
+        for label in labels:
+            for model_config in algorithms:
+                if label + label_algo_separator + model_config.get("name") == score_column_name:
+                    return label, model_config, train_features
+
+    return None
+
+
+def _learning_matrix(scaler, df_X, df_y, model_config: dict):
+    """
+    Feature matrix and labels of the rows which have all (possibly shifted) features and a label.
+    The mask of these rows is also returned. The scaler of the model is not changed.
+    """
+    shifts = model_config.get("train", {}).get("shifts", None)
+    if shifts:
+        X = lagged_matrix(df_X.values, shifts)
+    else:
+        X = df_X.values
+    X = np.asarray(X, dtype=float)
+
+    valid = ~np.isnan(X).any(axis=1) & df_y.notna().values
+    X = X[valid]
+    y = df_y.values[valid]
+
+    if scaler is not None and len(X) > 0:
+        X = scaler.transform(X)
+
+    return X, y, valid
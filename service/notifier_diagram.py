@@ -35,7 +35,7 @@ async def send_diagram():
     freq = model.get("freq")  # Aggregation interval 'H' - hour.
     nrows = model.get("nrows")  # Time range (x axis) of the diagram, for example, 1 week 168 hours, 2 weeks 336 hours
 
-    df = App.df
+    df = App.history.tail(1)
     row = df.iloc[-1]  # Last row stores the latest values we need
 
     # Decide whether to send it or not. Currently daily frequency hard-coded
@@ -51,7 +51,7 @@ async def send_diagram():
     vis_columns = ['open', 'high', 'low', 'close']
     if score_column_names:
         vis_columns.append(score_column_names)
-    df_ohlc = App.df[vis_columns]
+    df_ohlc = App.history.tail(columns=vis_columns)
     df_ohlc = resample_ohlc_data(df_ohlc.reset_index(), freq, nrows, score_column=score_column_names, buy_signal_column=None, sell_signal_column=None)
 
     # Get transaction data
@@ -23,7 +23,7 @@ async def send_score_notification():
         log.error(f"Empty list of score columns in score notifier. At least one column name with a score has to be provided in config. Ignore")
         return
 
-    df = App.df
+    df = App.history.tail(1)
     row = df.iloc[-1]  # Last row stores the latest values we need
 
     close_time = row.name + timedelta(minutes=1)  # Add 1 minute because timestamp is start of the interval
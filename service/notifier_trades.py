@@ -25,7 +25,7 @@ async def simulate_trade():
     """
     symbol = App.config["symbol"]
 
-    df = App.df
+    df = App.history.tail(1)
     row = df.iloc[-1]  # Last row stores the latest values we need
 
     close_time = row.name + timedelta(minutes=1)  # Add 1 minute because timestamp is start of the interval
@@ -10,11 +10,14 @@ from service.App import *
 from common.utils import *
 from service.collector import *
 from service.analyzer import *
+from service.learner import *
 from service.notifier_trades import *
 from service.notifier_scores import *
 from service.notifier_diagram import *
 from service.trader import *
 
+import time  # After the star imports which export datetime.time
+
 import logging
 
 log = logging.getLogger('server')
@@ -26,47 +29,92 @@ log = logging.getLogger('server')
 
 async def main_task():
     """This task will be executed regularly according to the schedule"""
-    res = await main_collector_task()
-    if res:
-        return res
+    start = time.perf_counter()
+    signal_delay = None
+    try:
+        with App.latency.span("collect"):
+            res = await main_collector_task()
+        if res:
+            return res
 
-    # TODO: Validation
-    #last_kline_ts = App.analyzer.get_last_kline_ts(symbol)
-    #if last_kline_ts + 60_000 != startTime:
-    #    log.error(f"Problem during analysis. Last kline end ts {last_kline_ts + 60_000} not equal to start of current interval {startTime}.")
+        # TODO: Validation
+        #last_kline_ts = App.analyzer.get_last_kline_ts(symbol)
+        #if last_kline_ts + 60_000 != startTime:
+        #    log.error(f"Problem during analysis. Last kline end ts {last_kline_ts + 60_000} not equal to start of current interval {startTime}.")
+
+        # Apply all transformations: merge, features, prediction scores, signals
+        try:
+            with App.latency.span("analyze"):
+                analyze_task = await App.loop.run_in_executor(None, App.analyzer.analyze)
+        except Exception as e:
+            print(f"Error while analyzing data: {e}")
+            return
+
+        # Time from the close of the latest kline to its signal (wall clock because the close time comes from the exchange)
+        if App.history is not None and len(App.history):
+            close_time = App.history.last_index() + timedelta(minutes=1)  # Add 1 minute because timestamp is start of the interval
+            signal_delay = time.time() - close_time.timestamp()
+            App.latency.add("signal_delay", signal_delay)
+
+        score_notification_model = App.config["score_notification_model"]
+        if score_notification_model.get("score_notification"):
+            with App.latency.span("notify.scores"):
+                await send_score_notification()
+
+        diagram_notification_model = App.config["diagram_notification_model"]
+        if diagram_notification_model.get("diagram_notification"):
+            with App.latency.span("notify.diagram"):
+                await send_diagram()
+
+        trade_model = App.config.get("trade_model", {})
+        if trade_model.get("simulate_trade"):
+            with App.latency.span("trade.simulate"):
+                transaction = await simulate_trade()
+                if transaction:
+                    await send_transaction_message(transaction)
+
+        # Now we have a list of signals and can make trade decisions using trading logic and trade
+        if "trade" in App.config.get("actions", {}):
+            trade_task = App.loop.create_task(measure_task("trade", main_trader_task()))
 
-    # Apply all transformations: merge, features, prediction scores, signals
-    try:
-        analyze_task = await App.loop.run_in_executor(None, App.analyzer.analyze)
-    except Exception as e:
-        print(f"Error while analyzing data: {e}")
         return
+    finally:
+        App.latency.add("total", time.perf_counter() - start)
+        report_latency(signal_delay)
 
-    score_notification_model = App.config["score_notification_model"]
-    if score_notification_model.get("score_notification"):
-        await send_score_notification()
 
-    diagram_notification_model = App.config["diagram_notification_model"]
-    if diagram_notification_model.get("diagram_notification"):
-        await send_diagram()
+async def measure_task(name: str, coro):
+    """Await the coroutine (which is executed as a separate task) and store its duration."""
+    with App.latency.span(name):
+        return await coro
 
-    trade_model = App.config.get("trade_model", {})
-    if trade_model.get("simulate_trade"):
-        transaction = await simulate_trade()
-        if transaction:
-            await send_transaction_message(transaction)
 
-    # Now we have a list of signals and can make trade decisions using trading logic and trade
-    if "trade" in App.config.get("actions", {}):
-        trade_task = App.loop.create_task(main_trader_task())
+def report_latency(signal_delay: float = None):
+    """Write the latency percentiles to the metrics file and warn if the last run of the main task approaches the time budget."""
+    latency_config = App.config.get("latency_metrics", {})
+    budget = latency_config.get("budget", 60)
 
-    return
+    elapsed = max(App.latency.last("total"), signal_delay or 0.0)
+    if elapsed >= latency_config.get("warning", 0.8) * budget:
+        stages = ["collect", "analyze", "notify.scores", "notify.diagram", "trade.simulate", "trade"]
+        stage_times = ", ".join([f"{name}={App.latency.last(name):.2f}" for name in stages if name in App.latency.spans])
+        log.warning(f"Main task is close to the time budget: {elapsed:.2f} of {budget} seconds (signal delay {signal_delay or 0.0:.2f}). Last stage times (s): {stage_times}")
+
+    file_name = latency_config.get("file")
+    if file_name:
+        try:
+            App.latency.write(file_name)
+        except Exception as e:
+            log.error(f"Error writing latency metrics to '{file_name}': {e}")
 
 
 @click.command()
 @click.option('--config_file', '-c', type=click.Path(), default='', help='Configuration file name')
 def start_server(config_file):
 
+    start_time = time.perf_counter()
+    startup_times = {}  # Seconds spent on each startup phase
+
     load_config(config_file)
 
     symbol = App.config["symbol"]
@@ -84,7 +132,13 @@ def start_server(config_file):
     #
     App.client = Client(api_key=App.config["api_key"], api_secret=App.config["api_secret"])
 
-    App.analyzer = Analyzer(App.config)
+    phase_start = time.perf_counter()
+    App.analyzer = Analyzer(App.config)  # Models are loaded here
+    startup_times["analyzer"] = time.perf_counter() - phase_start
+
+    model_reload_period = App.config.get("model_reload_period")
+    if model_reload_period:
+        App.analyzer.start_model_watcher(model_reload_period)
 
     App.loop = asyncio.get_event_loop()
 
@@ -102,12 +156,16 @@ def start_server(config_file):
 
     # Cold start: load initial data, do complete analysis
     try:
+        phase_start = time.perf_counter()
         App.loop.run_until_complete(sync_data_collector_task())
         # First call may take some time because of big initial size and hence we make the second call to get the (possible) newest klines
         App.loop.run_until_complete(sync_data_collector_task())
+        startup_times["collection"] = time.perf_counter() - phase_start
 
         # Analyze all received data (and not only last few rows) so that we have full history
+        phase_start = time.perf_counter()
         App.analyzer.analyze(ignore_last_rows=True)
+        startup_times["analysis"] = time.perf_counter() - phase_start
     except Exception as e:
         print(f"Problems during initial data collection. {e}")
 
@@ -132,6 +190,9 @@ def start_server(config_file):
         print(f"Balance: {App.config['base_asset']} = {str(App.base_quantity)}")
         print(f"Balance: {App.config['quote_asset']} = {str(App.quote_quantity)}")
 
+    # Latency metrics are collected only for the regular runs (and not the initial analysis)
+    App.latency = LatencyStats(App.config.get("latency_metrics", {}).get("window", 1440))
+
     #
     # Register scheduler
     #
@@ -148,10 +209,21 @@ def start_server(config_file):
         id='main_task'
     )
 
+    online_learning = App.config.get("online_learning", {})
+    if online_learning.get("models"):
+        App.sched.add_job(
+            online_learner_task,
+            trigger='interval',
+            minutes=online_learning.get("period", 15),
+            id='online_learner_task'
+        )
+
     App.sched.start()  # Start scheduler (essentially, start the thread)
 
     print(f"Scheduler started.")
 
+    print_startup_times(startup_times, time.perf_counter() - start_time)
+
     #
     # Start event loop
     #
@@ -164,9 +236,18 @@ def start_server(config_file):
         print(f"Event loop closed.")
         App.sched.shutdown()
         print(f"Scheduler shutdown.")
+        App.analyzer.model_watcher_stop.set()
 
     return 0
 
 
+def print_startup_times(startup_times: dict, total_time: float):
+    """Print how long the startup phases took including (lazy) imports of the algorithm libraries."""
+    print(f"Startup time: {total_time:.2f} seconds.")
+    for phase, seconds in startup_times.items():
+        print(f"  {phase}: {seconds:.2f} seconds")
+    print_import_times()  # Each import is part of the phase where the library was first used
+
+
 if __name__ == "__main__":
     start_server()
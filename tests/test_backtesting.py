@@ -0,0 +1,61 @@
+import pytest
+
+from common.gen_signals import *
+from common.backtesting import *
+
+
+def test_simulated_trade_performance_arrays():
+	"""Compiled trade simulation has to return exactly the same results as the reference implementation."""
+	rng = np.random.default_rng(1)
+	n = 5000
+	price = 100 + np.cumsum(rng.normal(size=n))
+	price[rng.random(n) < 0.01] = np.nan
+	price[5] = 0.0  # Rows with zero price are skipped
+	df = pd.DataFrame(
+		{"buy": rng.random(n) < 0.02, "sell": rng.random(n) < 0.02, "close": price},
+		index=pd.date_range("2020-01-01", periods=n, freq="min")
+	)
+
+	expected = simulated_trade_performance(df, "buy", "sell", "close")
+
+	result = simulated_trade_performance_arrays(df["buy"].values, df["sell"].values, df["close"].values, df.index, with_transactions=True)
+	assert result == expected
+
+	performance, long_performance, short_performance = simulated_trade_performance_arrays(df["buy"], df["sell"], df["close"])
+	assert "transactions" not in long_performance
+	long_performance["transactions"] = expected[1]["transactions"]
+	short_performance["transactions"] = expected[2]["transactions"]
+	assert (performance, long_performance, short_performance) == expected
+
+	pass
+
+
+def test_threshold_rule_grid_performance():
+	"""Batched evaluation of threshold rules has to be equal to generating signal columns and simulating trades for each parameter set."""
+	rng = np.random.default_rng(2)
+	n = 3000
+	df = pd.DataFrame({
+		"close": 100 + np.cumsum(rng.normal(size=n)),
+		"score": np.tanh(rng.normal(size=n)),
+		"score_2": np.tanh(rng.normal(size=n)),
+	})
+	df.loc[10:20, "score"] = np.nan
+
+	parameter_list = [
+		dict(buy_signal_threshold=b, sell_signal_threshold=s, buy_signal_threshold_2=b2, sell_signal_threshold_2=-b2)
+		for b in [0.0, 0.3, 0.6] for s in [-0.1, -0.5] for b2 in [-0.2, 0.2]
+	]
+
+	results = threshold_rule_grid_performance(df["score"], df["close"], parameter_list)
+	results_2 = threshold_rule_grid_performance(df["score"], df["close"], parameter_list, df["score_2"])
+
+	for parameters, result, result_2 in zip(parameter_list, results, results_2):
+		config = dict(columns="score", names=["buy", "sell"], parameters=parameters)
+		signal_df, _ = generate_threshold_rule(df.copy(), config)
+		assert result == simulated_trade_performance_arrays(signal_df["buy"], signal_df["sell"], signal_df["close"])
+
+		config = dict(columns=["score", "score_2"], names=["buy", "sell"], parameters=parameters)
+		signal_df, _ = generate_threshold_rule2(df.copy(), config)
+		assert result_2 == simulated_trade_performance_arrays(signal_df["buy"], signal_df["sell"], signal_df["close"])
+
+	pass
@@ -35,3 +35,58 @@ def test_nan_handling_predict():
 
 	pass
 
+
+def test_lagged_matrix():
+	"""Lagged matrix has to be equal to the concatenation of shifted data frames."""
+	df = pd.DataFrame({"x": [1.0, 2.0, 3.0, 4.0, 5.0], "y": [10.0, np.nan, 30.0, 40.0, 50.0]})
+	shifts = [1, 3, -1]
+
+	X = lagged_matrix(df.values, shifts)
+
+	expected = pd.concat([df] + [df.shift(shift) for shift in shifts], axis=1)
+	assert X.shape == expected.shape
+	np.testing.assert_array_equal(X, expected.values)
+
+	pass
+
+
+def test_svc_approximation():
+	"""SVC with kernel approximation is a pipeline with the same interface and NaN handling as the exact SVC."""
+	df_X = pd.DataFrame({"x": [1, 2, 3, 2, 1, 4, 5, 3, 6, 1], "y": [0, 1, 0, 1, 0, 1, 1, 0, 1, 0]})
+	df_X_test = pd.DataFrame({"x": [1, 2, None, 2, np.nan]})
+
+	for approximation in ["nystroem", "rff"]:
+		model_config = dict(params=dict(approximation=approximation, n_components=5, C=1.0), train=dict(is_scale=True))
+		model_pair = train_svc(df_X[["x"]], df_X["y"], model_config)
+		test_hat = predict_svc(model_pair, df_X_test[["x"]], model_config)
+		assert 5 == len(test_hat)
+		assert 2 == test_hat.isnull().sum()
+
+	# Parameters which would be ignored by the approximation are rejected
+	for params in [dict(approximation="rff", kernel="poly"), dict(approximation="rff", degree=3), dict(approximation="nystroem", probability=True)]:
+		with pytest.raises(ValueError):
+			train_svc(df_X[["x"]], df_X["y"], dict(params=params, train=dict(is_scale=True)))
+
+	pass
+
+
+def test_predict_fused():
+	"""Fused prediction of several models with different preprocessing is equal to predicting each model separately."""
+	df_X = pd.DataFrame({"x": [1, 2, 3, 2, 1, 4, 5, 3, 6, 1], "y": [0, 1, 0, 1, 0, 1, 1, 0, 1, 0]})
+	df_X_test = pd.DataFrame({"x": [1, 2, None, 2, np.nan, 3]})
+
+	model_list = []
+	for name, shifts in [("lc", []), ("lc_shifted", [1]), ("lc_shifted2", [1])]:
+		model_config = dict(params=dict(max_iter=50), train=dict(is_scale=True, shifts=shifts))
+		model_pair = train_lc(df_X[["x"]], df_X["y"], model_config)
+		model_list.append((name, "lc", model_pair, model_config))
+
+	latencies = {}
+	y_hat = predict_fused(model_list, df_X_test[["x"]].values, latencies)
+
+	assert y_hat.shape == (6, 3)
+	for i, (name, algo_type, model_pair, model_config) in enumerate(model_list):
+		np.testing.assert_array_equal(y_hat[:, i], predict_array(algo_type, model_pair, df_X_test[["x"]], model_config))
+	assert set(latencies.keys()) == {"lc", "lc_shifted", "lc_shifted2"}
+
+	pass
@@ -0,0 +1,117 @@
+import pytest
+
+from common import gen_signals
+from common.gen_signals import *
+
+
+def test_generate_combine_scores():
+	"""Array expressions have to produce the same scores as the row-wise version and the streaming version has to compute the last rows."""
+	rng = np.random.default_rng(3)
+	n = 1000
+	df = pd.DataFrame({"up": rng.random(n), "down": rng.random(n)})
+	df.loc[[3, 7], "up"] = np.nan
+	df.loc[[7, 9], "down"] = np.nan
+
+	config = {"columns": ["up", "down"], "names": "score", "coefficient": 2.0, "constant": 0.1}
+	df, features = generate_combine_scores(df, config)
+	assert features == ["score"]
+
+	expected = df[["up", "down"]].apply(lambda x: x[0] if x[0] >= x[1] else -x[1], raw=True, axis=1) * 2.0 + 0.1
+	pd.testing.assert_series_equal(df["score"], expected, check_names=False)
+
+	for combine, expected in [("relative", (df["up"] / (df["up"] + df["down"])) * 2 - 1.0), ("difference", df["up"] - df["down"])]:
+		df, _ = generate_combine_scores(df, {"columns": ["up", "down"], "names": "score", "combine": combine})
+		pd.testing.assert_series_equal(df["score"], expected, check_names=False)
+
+	# Streaming: only the last rows are computed
+	df, _ = generate_combine_scores(df, config | {"combine": None}, last_rows=5)
+	batch_df, _ = generate_combine_scores(df.copy(), config)
+	assert df["score"].iloc[:-5].isnull().all()
+	pd.testing.assert_series_equal(df["score"].iloc[-5:], batch_df["score"].iloc[-5:])
+
+	pass
+
+
+@pytest.mark.parametrize("window,point_threshold", [(20, None), (20.0, None), (10, 0.5), (7.0, 0.5)])
+def test_smoothen_scores_streaming(window, point_threshold):
+	"""Streaming smoother which gets only the last rows in each call has to produce the same values as the batch version."""
+	gen_signals.smoothen_states.clear()
+
+	rng = np.random.default_rng(4)
+	n = 500
+	df = pd.DataFrame(
+		{"a": rng.random(n), "b": rng.random(n)},
+		index=pd.date_range("2020-01-01", periods=n, freq="min")
+	)
+	df.loc[df.index[[30, 31, 32, 100]], "a"] = np.nan
+	df.loc[df.index[30:60], "b"] = np.nan
+
+	config = {"columns": ["a", "b"], "names": "score", "window": window, "point_threshold": point_threshold}
+	expected, _ = generate_smoothen_scores(df.copy(), config)
+
+	last_rows = 10
+	end = last_rows
+	streamed = {}
+	while end <= n:
+		tail_df, _ = generate_smoothen_scores(df.iloc[end - last_rows:end].copy(), config, last_rows=last_rows)
+		streamed[tail_df.index[-1]] = tail_df["score"].iloc[-1]
+		end += 1 + end % 3  # Sometimes several new rows are added
+
+	streamed = pd.Series(streamed)
+	np.testing.assert_allclose(streamed.values, expected["score"].loc[streamed.index].values, rtol=1e-12, atol=1e-12)
+
+	# State built from all rows (full analysis) continues with the last rows without a new warm-up
+	gen_signals.smoothen_states.clear()
+	full_df, _ = generate_smoothen_scores(df.iloc[:200].copy(), config, last_rows=200)
+	np.testing.assert_allclose(full_df["score"].values, expected["score"].iloc[:200].values, rtol=1e-12, atol=1e-12)
+	for end in range(201, 206):
+		tail_df, _ = generate_smoothen_scores(df.iloc[end - last_rows:end].copy(), config, last_rows=last_rows)
+		np.testing.assert_allclose(tail_df["score"].iloc[-1], expected["score"].iloc[end - 1], rtol=1e-12, atol=1e-12)
+	assert len(gen_signals.smoothen_states["score"].outputs) == last_rows
+
+	# Rows which have been processed are scored again with other values (like the last kline which is still forming)
+	gen_signals.smoothen_states.clear()
+	forming = df + rng.normal(size=df.shape) * 0.3
+	for end in range(last_rows, n + 1):
+		tail_df = df.iloc[end - last_rows:end].copy()
+		tail_df.iloc[-1] = forming.iloc[end - 1]  # It will be replaced by the final values in the next call
+		tail_df, _ = generate_smoothen_scores(tail_df, config, last_rows=last_rows)
+		if end > 2 * last_rows:
+			np.testing.assert_allclose(tail_df["score"].iloc[:-1].values, expected["score"].iloc[end - last_rows:end - 1].values, rtol=1e-12, atol=1e-12)
+
+	pass
+
+
+def test_interval_precision_sweep():
+	"""Sweep has to produce the same interval-wise results as find_interval_precision for each pair."""
+	rng = np.random.default_rng(5)
+	n = 2000
+	df = pd.DataFrame({
+		"label": np.repeat(rng.random(n // 20) < 0.3, 20) ^ (rng.random(n) < 0.05),
+		"score_1": rng.random(n),
+		"score_2": rng.random(n),
+	})
+	df.loc[[1, 2, 50], "score_2"] = np.nan
+
+	pairs = [(column, threshold) for column in ["score_1", "score_2"] for threshold in [0.5, 0.9, 0.99]]
+	result = interval_precision_sweep(df, "label", pairs)
+	assert len(result) == len(pairs)
+
+	for (column, threshold), row in zip(pairs, result.itertuples()):
+		interval_df = find_interval_precision(df.copy(), label_column="label", score_column=column, threshold=threshold)
+		labels = interval_df["label"].astype(bool)
+		scores = interval_df[column].astype(bool)
+		assert (row.score_column, row.threshold) == (column, threshold)
+		assert row.tp == (labels & scores).sum()
+		assert row.fp == (~labels & scores).sum()
+		assert row.fn == (labels & ~scores).sum()
+		assert row.tn == (~labels & ~scores).sum()
+
+	# Precomputed intervals are reused. With below, the minimum score of an interval is compared (as for negated scores)
+	intervals = find_intervals(df["label"].to_numpy())
+	result_below = interval_precision_sweep(df, "label", pairs, intervals, below=True)
+	df_negated = pd.DataFrame({"label": df["label"], "score_1": -df["score_1"], "score_2": -df["score_2"]})
+	result_negated = interval_precision_sweep(df_negated, "label", [(column, -threshold) for column, threshold in pairs])
+	assert result_below[["tp", "fp", "fn", "tn"]].equals(result_negated[["tp", "fp", "fn", "tn"]])
+
+	pass
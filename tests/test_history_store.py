@@ -0,0 +1,52 @@
+import pytest
+
+import numpy as np
+import pandas as pd
+
+from service.history_store import *
+
+
+def _results(start: int, count: int, seed: int):
+	rng = np.random.default_rng(seed)
+	index = pd.date_range("2020-01-01", periods=count, freq="1min") + pd.Timedelta(minutes=start)
+	df = pd.DataFrame({
+		"close": rng.random(count),
+		"trade_score": rng.random(count),
+		"buy_signal_column": rng.random(count) > 0.5,
+	}, index=index)
+	df.loc[df.index[0], "trade_score"] = np.nan  # Missing values do not overwrite stored values
+	df.index.name = "timestamp"
+	return df
+
+
+def test_history_store():
+	"""History has to store the same rows as appending with combine_first and removing the oldest rows."""
+	capacity = 10
+	history = HistoryStore(capacity)
+	expected = None
+
+	for i, (start, count) in enumerate([(0, 4), (2, 5), (6, 3), (8, 1), (7, 12), (25, 3), (26, 2)]):
+		df = _results(start, count, seed=i)
+
+		history.upsert(df)
+		expected = df if expected is None else df.combine_first(expected)
+		expected = expected.tail(capacity)
+
+		assert len(history) == len(expected)
+		assert history.last_index() == expected.index[-1]
+		pd.testing.assert_frame_equal(history.tail(), expected[history.tail().columns], check_dtype=False, check_freq=False)
+		pd.testing.assert_frame_equal(history.tail(3), expected.tail(3)[history.tail().columns], check_dtype=False, check_freq=False)
+
+	row = history.get_row(expected.index[-2], ["close", "trade_score"])
+	assert row.tolist() == pytest.approx(expected[["close", "trade_score"]].iloc[-2].tolist())
+	assert history.get_row(expected.index[0] - pd.Timedelta(minutes=1), ["close"]) is None
+
+	# Data frames are read-only views of the stored values
+	with pytest.raises(ValueError):
+		history.tail(1)["close"].to_numpy()[0] = 0.0
+
+	# Copies (for readers in other threads) are not changed by later upserts
+	copied = history.tail(copy=True)
+	expected_copy = copied.copy()
+	history.upsert(_results(26, 5, seed=10))
+	pd.testing.assert_frame_equal(copied, expected_copy)
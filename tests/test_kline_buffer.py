@@ -0,0 +1,72 @@
+import pytest
+
+import numpy as np
+import pandas as pd
+
+from common.gen_features import klines_to_df
+from service.kline_buffer import *
+
+
+def _klines(start: int, count: int):
+	ts0 = 1_600_000_000_000
+	return [
+		[ts0 + i * 60_000, f"{100 + i}.5", f"{101 + i}.25", f"{99 + i}.75", f"{100 + i}.125", "12.5", ts0 + i * 60_000 + 59_999, "1250.5", 10 + i, "6.25", "625.5", "0"]
+		for i in range(start, start + count)
+	]
+
+
+def test_kline_buffer():
+	"""Ring buffer has to store the same klines as the list-based storage (overwrite overlapping klines and remove the oldest ones)."""
+	capacity = 10
+	buffer = KlineBuffer(capacity)
+	stored = []  # Reference list storage
+
+	for start, count in [(0, 4), (2, 5), (6, 3), (9, 1), (9, 12), (25, 3), (26, 2)]:
+		klines = _klines(start, count)
+
+		num_deleted = buffer.store(klines)
+
+		expected_deleted = len([x for x in stored if x[0] >= klines[0][0]])
+		stored = [x for x in stored if x[0] < klines[0][0]] + klines
+		stored = stored[-capacity:]
+
+		assert num_deleted == expected_deleted
+		assert len(buffer) == len(stored)
+		assert buffer.last()[0] == stored[-1][0] and buffer.last()[4] == float(stored[-1][4])
+		assert buffer.last_timestamp() == stored[-1][0]
+
+		df = buffer.to_df()
+		expected_df = klines_to_df(stored)
+		pd.testing.assert_frame_equal(df.drop(columns="ignore"), expected_df.drop(columns="ignore"))
+
+	assert not buffer.is_regular(len(buffer))  # Gap between 20 and 25
+	assert buffer.is_regular(3)
+
+	# Columns are views of the buffer
+	assert np.shares_memory(buffer.column("close"), buffer.data)
+
+	pass
+
+
+def test_data_source_aligner():
+	"""Aligned klines have to be equal to the data frames of all sources joined on a regular time index (as in merge_data_sources)."""
+	data_sources = [{"folder": "A", "file": "klines", "column_prefix": ""}, {"folder": "B", "file": "klines", "column_prefix": "b"}]
+	buffers = {"A": KlineBuffer(20), "B": KlineBuffer(20)}
+	aligner = DataSourceAligner(data_sources, 25)
+
+	for a, b in [((0, 15), (3, 11)), ((14, 4), (13, 3)), ((18, 27), (17, 27))]:
+		buffers["A"].store(_klines(*a))
+		buffers["B"].store(_klines(*b)[:2] + _klines(*b)[3:])  # One missing kline
+		aligner.update(buffers)
+
+		df = aligner.to_df()
+
+		dfs = [buffers["A"].to_df(), buffers["B"].to_df().add_prefix("b_")]
+		index = pd.date_range(min(x.index[0] for x in dfs), min(x.index[-1] for x in dfs), freq="min")
+		expected_df = pd.DataFrame(index=index).join(dfs[0]).join(dfs[1])
+		expected_df.index.name = "timestamp"
+		pd.testing.assert_frame_equal(df.drop(columns=["ignore", "b_ignore"]), expected_df.drop(columns=["ignore", "b_ignore"]), check_freq=False)
+
+		assert aligner.gaps()["B"] == expected_df["b_close"].isnull().sum()
+
+	pass
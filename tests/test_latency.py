@@ -0,0 +1,39 @@
+import json
+
+import numpy as np
+
+from service.latency import *
+
+
+def test_latency_stats(tmp_path):
+	"""Percentiles are computed for the rolling window of the last durations of each span."""
+	stats = LatencyStats(window=100)
+	values = np.arange(1, 151) / 1000.0  # 1..150 ms
+	for v in values:
+		stats.add("analyze", v)
+
+	with stats.span("collect"):
+		pass
+	try:
+		with stats.span("trade"):
+			raise ValueError()
+	except ValueError:
+		pass
+
+	assert len(stats.spans["analyze"]) == 100
+	assert stats.last("analyze") == values[-1]
+	assert stats.last("notify.scores") == 0.0
+	assert stats.spans["collect"][0] >= 0.0
+	assert len(stats.spans["trade"]) == 1  # Duration is stored also if an exception is raised
+
+	summary = stats.summary()
+	expected = np.percentile(values[-100:] * 1000.0, [50, 95, 99])
+	assert [summary["analyze"][k] for k in ["p50", "p95", "p99"]] == list(np.round(expected, 3))
+	assert summary["analyze"]["max"] == 150.0
+	assert summary["analyze"]["count"] == 100
+
+	file_path = tmp_path / "latency.json"
+	stats.write(file_path)
+	metrics = json.loads(file_path.read_text())
+	assert metrics["window"] == 100
+	assert metrics["spans"]["analyze"] == summary["analyze"]
@@ -0,0 +1,46 @@
+import pytest
+
+from common.classifiers import *
+from common.model_store import *
+
+
+def test_model_bundle(tmp_path):
+	"""Models loaded from the bundle produce the same predictions as the original models."""
+	df_X = pd.DataFrame({"x": [1, 2, 3, 2, 1, 4, 5, 3], "y": [0, 1, 0, 1, 0, 1, 1, 0]})
+	model_config = dict(params=dict(max_iter=50), train=dict(is_scale=True))
+
+	model_pair = train_lc(df_X[["x"]], df_X["y"], model_config)
+	save_model_bundle(tmp_path, "models.bundle", {"y_lc": model_pair})
+
+	models = load_model_bundle(tmp_path, "models.bundle")
+	assert list(models.keys()) == ["y_lc"]
+
+	y_hat = predict_array("lc", model_pair, df_X[["x"]], model_config)
+	y_hat_bundle = predict_array("lc", models["y_lc"], df_X[["x"]], model_config)
+	assert np.array_equal(y_hat, y_hat_bundle)
+
+	# Model and scaler arrays are used directly from the memory-mapped bundle (not copied)
+	assert is_memory_mapped(models["y_lc"][0].coef_)
+	assert is_memory_mapped(models["y_lc"][1].mean_)
+
+	# The bundle is used only if it was created from the current model files
+	save_model_pair(tmp_path, "y_lc", model_pair)
+	assert load_model_bundle_if_valid(tmp_path, "models.bundle", ["y_lc"]) is None
+	save_model_bundle(tmp_path, "models.bundle", {"y_lc": model_pair})
+	assert load_model_bundle_if_valid(tmp_path, "models.bundle", ["y_lc"]) is not None
+
+	# Model files different from the bundle have priority even if their modification time is older (e.g., copied with cp -p)
+	other_pair = train_lc(df_X[["x"]], 1 - df_X["y"], model_config)
+	save_model_pair(tmp_path, "y_lc", other_pair)
+	for extension in [".scaler", ".pickle"]:
+		os.utime((tmp_path / "y_lc").with_suffix(extension), (0, 0))
+	assert load_model_bundle_if_valid(tmp_path, "models.bundle", ["y_lc"]) is None
+
+
+def is_memory_mapped(array):
+	"""Whether the array is a view of a memory-mapped file."""
+	while isinstance(array, np.ndarray):
+		if isinstance(array, np.memmap):
+			return True
+		array = array.base
+	return False
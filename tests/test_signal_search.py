@@ -0,0 +1,27 @@
+import pytest
+
+from common.signal_search import *
+
+
+def test_search_parameters():
+	"""Adaptive search methods find the maximum of a unimodal function with a small number of evaluations."""
+	grid = {"a": list(range(30)), "b": [x / 10 for x in range(-20, 21)]}
+	objective = lambda p: -(p["a"] - 17) ** 2 - 10 * (p["b"] - 0.8) ** 2
+	evaluate_fn = lambda parameter_list: [dict(model=p, value=objective(p)) for p in parameter_list]
+
+	results = search_parameters(grid, evaluate_fn, lambda x: x["value"], {})
+	assert len(results) == 30 * 41
+
+	for search_config in [dict(method="refine"), dict(method="bayes", n_initial=20, n_iterations=20, batch_size=10)]:
+		results = search_parameters(grid, evaluate_fn, lambda x: x["value"], search_config)
+		assert len(results) < 30 * 41 / 3
+		best = max(results, key=lambda x: x["value"])
+		if search_config["method"] == "refine":
+			assert best["model"] == {"a": 17, "b": 0.8}
+		else:
+			assert best["value"] >= -4
+
+	with pytest.raises(ValueError):
+		search_parameters(grid, evaluate_fn, lambda x: x["value"], dict(method="unknown"))
+
+	pass